@@ -13,12 +13,73 @@ class Settings(BaseSettings):
     upload_folder: str = os.getenv("UPLOAD_FOLDER", str(Path("./data/uploads").absolute()))
     attachment_storage_path: str = os.getenv("ATTACHMENT_STORAGE_PATH", str(Path("./data/attachments").absolute()))
     max_upload_size: int = int(os.getenv("MAX_UPLOAD_SIZE", 1024 * 1024 * 1024))  # 1GB max file size
-    max_attachment_size: int = 10 * 1024 * 1024  # 10MB
+    upload_chunk_size: int = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # 1MB streaming chunks
+    max_attachment_size: int = int(os.getenv("MAX_ATTACHMENT_SIZE", 10 * 1024 * 1024))  # 10MB
+    attachment_size_policy: str = os.getenv("ATTACHMENT_SIZE_POLICY", "skip")  # 'skip', 'truncate' or 'keep' oversized attachments
+    attachment_chunk_size: int = int(os.getenv("ATTACHMENT_CHUNK_SIZE", 1024 * 1024))  # bytes read per attachment chunk
     allowed_file_types: list[str] = [".pst", ".mbox"]
+
+    # Ingestion settings
+    ingestion_workers: int = int(os.getenv("INGESTION_WORKERS", 2))  # concurrent ingestion jobs
+    progress_interval: int = int(os.getenv("PROGRESS_INTERVAL", 100))  # messages between progress updates
+    ingestion_batch_size: int = int(os.getenv("INGESTION_BATCH_SIZE", 1000))  # emails per insert transaction
+    parser_workers: int = int(os.getenv("PARSER_WORKERS", 1))  # processes parsing PST/MBOX messages, 1 parses inline
+    parser_task_size: int = int(os.getenv("PARSER_TASK_SIZE", 500))  # messages handed to a parser process at a time
+    extraction_workers: int = int(os.getenv("EXTRACTION_WORKERS", os.cpu_count() or 1))  # processes extracting attachment text
+    extraction_batch_size: int = int(os.getenv("EXTRACTION_BATCH_SIZE", 100))  # attachments per extraction commit
+    extraction_timeout: float = float(os.getenv("EXTRACTION_TIMEOUT", 60))  # seconds per attachment
+    extraction_max_pages: int = int(os.getenv("EXTRACTION_MAX_PAGES", 500))  # pages/slides/sheets read per attachment
+    extraction_max_chars: int = int(os.getenv("EXTRACTION_MAX_CHARS", 1000000))  # characters kept per attachment
+    extraction_max_bytes: int = int(os.getenv("EXTRACTION_MAX_BYTES", 100 * 1024 * 1024))  # larger files are not parsed
+    identity_cache_size: int = int(os.getenv("IDENTITY_CACHE_SIZE", 100000))  # process-wide contact/org LRU entries, 0 disables
+    identity_cache_prewarm_limit: int = int(os.getenv("IDENTITY_CACHE_PREWARM_LIMIT", 100000))  # rows loaded per ingestion
     
+    # API settings
+    list_page_max: int = int(os.getenv("LIST_PAGE_MAX", 1000))  # largest page the list endpoints return
+
+    # Threading settings
+    thread_subject_window_days: int = int(os.getenv("THREAD_SUBJECT_WINDOW_DAYS", 30))  # replies without references join a same-subject thread this recent
+
+    # Triage settings
+    triage_model_path: str = os.getenv("TRIAGE_MODEL_PATH", "")  # trained weight vector (.npy), empty uses the built-in seed weights
+    triage_body_chars: int = int(os.getenv("TRIAGE_BODY_CHARS", 4000))  # body head and tail characters scored
+    triage_low_threshold: float = float(os.getenv("TRIAGE_LOW_THRESHOLD", -3.0))  # scores at or below mark an email 'low'
+
+    # Search settings
+    embedding_backend: str = os.getenv("EMBEDDING_BACKEND", "hashing")  # 'hashing' (local, deterministic) or 'openai'
+    embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    embedding_dimension: int = int(os.getenv("EMBEDDING_DIMENSION", 256))
+    embedding_batch_size: int = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))  # emails per embedding request
+    embedding_text_chars: int = int(os.getenv("EMBEDDING_TEXT_CHARS", 8000))  # email and attachment text embedded per email
+    vector_index_path: str = os.getenv("VECTOR_INDEX_PATH", str(Path("./data/vectors").absolute()))
+    ivf_min_vectors: int = int(os.getenv("IVF_MIN_VECTORS", 50000))  # smaller indexes are scanned exhaustively
+    ivf_lists: int = int(os.getenv("IVF_LISTS", 0))  # IVF clusters, 0 uses sqrt(vectors)
+    ivf_probes: int = int(os.getenv("IVF_PROBES", 16))  # clusters scanned per query
+
     # OpenAI settings
     openai_api_key: str
     openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4")
+    llm_provider: str = os.getenv("LLM_PROVIDER", "openai")  # 'openai', 'local' (OpenAI-compatible server) or 'stub'
+    llm_fast_model: str = os.getenv("LLM_FAST_MODEL", "")  # model for intermediate thread summaries, empty uses the main model
+    llm_local_base_url: str = os.getenv("LLM_LOCAL_BASE_URL", "http://localhost:8080/v1")
+    llm_local_model: str = os.getenv("LLM_LOCAL_MODEL", "local-model")
+    llm_local_api_key: str = os.getenv("LLM_LOCAL_API_KEY", "local")
+    llm_stub_latency: float = float(os.getenv("LLM_STUB_LATENCY", 0.5))  # seconds per stub completion
+    llm_max_connections: int = int(os.getenv("LLM_MAX_CONNECTIONS", 32))  # pooled HTTP connections to the provider
+    llm_timeout: float = float(os.getenv("LLM_TIMEOUT", 120))  # seconds per LLM request
+    analysis_workers: int = int(os.getenv("ANALYSIS_WORKERS", 1))  # concurrent bulk analysis jobs
+    analysis_concurrency: int = int(os.getenv("ANALYSIS_CONCURRENCY", 8))  # LLM requests in flight per bulk job
+    analysis_batch_size: int = int(os.getenv("ANALYSIS_BATCH_SIZE", 500))  # emails loaded per page
+    analysis_batch_tokens: int = int(os.getenv("ANALYSIS_BATCH_TOKENS", 6000))  # prompt tokens packed into one multi-email request
+    analysis_batch_max_emails: int = int(os.getenv("ANALYSIS_BATCH_MAX_EMAILS", 10))  # emails per request, 1 disables batching
+    analysis_skip_low_importance: bool = os.getenv("ANALYSIS_SKIP_LOW_IMPORTANCE", "true").lower() == "true"  # bulk analysis ignores triaged bulk mail
+    llm_requests_per_minute: int = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))  # 0 disables the limit
+    llm_tokens_per_minute: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", 150000))  # 0 disables the limit
+    llm_max_retries: int = int(os.getenv("LLM_MAX_RETRIES", 6))  # retries on rate limit (429) responses
+    thread_chunk_tokens: int = int(os.getenv("THREAD_CHUNK_TOKENS", 6000))  # longer threads are summarized in chunks of this size
+    thread_summary_tokens: int = int(os.getenv("THREAD_SUMMARY_TOKENS", 400))  # completion tokens per chunk summary
+    thread_map_concurrency: int = int(os.getenv("THREAD_MAP_CONCURRENCY", 4))  # chunk summaries requested at once
+    llm_cache_ttl: int = int(os.getenv("LLM_CACHE_TTL", 30 * 24 * 3600))  # seconds an analysis is reused, 0 never expires
 
     # CORS settings
     cors_origins: list[str] = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
@@ -4,7 +4,9 @@ from sqlalchemy.orm import sessionmaker
 from config import settings
 
 # Create SQLAlchemy engine
-engine = create_engine(settings.database_url)
+# SQLite connections are shared with the ingestion worker threads
+connect_args = {"check_same_thread": False} if settings.database_url.startswith("sqlite") else {}
+engine = create_engine(settings.database_url, connect_args=connect_args)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -1,21 +1,33 @@
 from fastapi import FastAPI, HTTPException, Depends, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
-from services.file_processor import EmailFileProcessor
 from services.email_service import EmailService
 from services.llm_analyzer import LLMAnalyzer, EmailAnalysis
 from database import SessionLocal, engine
 import models
 import uvicorn
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple, Callable, AsyncIterator
 import schemas
 from services.text_extraction import TextExtractionService
+from services.upload_service import UploadService, UploadTooLargeError, UploadOffsetError
+from services.ingestion_jobs import IngestionJobManager
+from services.search_index import create_search_index, SearchIndex
+from services.embeddings import EmbeddingService, get_embedding_backend
+from services.vector_index import VectorIndex
+from services.llm_cache import LLMResultCache
+from services.bulk_analysis import BulkAnalysisManager, load_recipients
 import traceback
 import os
+import json
+import asyncio
 from config import settings
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+create_search_index(engine)
 
 app = FastAPI()
 
@@ -28,6 +40,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+upload_service = UploadService()
+ingestion_jobs = IngestionJobManager()
+vector_index = VectorIndex()
+embedding_backend = get_embedding_backend()
+
+@app.on_event("startup")
+def resume_ingestion_jobs():
+    """Pick up ingestion jobs that were queued or running when the server last stopped"""
+    ingestion_jobs.resume()
+
+@app.on_event("shutdown")
+def shutdown_ingestion_jobs():
+    ingestion_jobs.shutdown()
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -40,77 +66,182 @@ def get_db():
 def read_root():
     return {"status": "ok"}
 
-@app.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
-    """Upload and process PST or MBOX file"""
-    # Validate file type
-    if not file.filename.lower().endswith(('.pst', '.mbox')):
-        raise HTTPException(
-            status_code=400,
-            detail="Only .pst and .mbox files are supported"
-        )
-    
-    # Save uploaded file
-    file_path = os.path.join(settings.UPLOAD_FOLDER, file.filename)
+def _check_mailbox(db: Session, mailbox_id: Optional[int]) -> None:
+    if mailbox_id is not None and db.get(models.Mailbox, mailbox_id) is None:
+        raise HTTPException(status_code=404, detail="Mailbox not found")
+
+def _queue_uploaded_file(file_path: str, filename: str, mailbox_id: Optional[int] = None) -> Dict:
+    """Queue an uploaded file for background ingestion, optionally as a re-import into a mailbox"""
     try:
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Process the file
-        processor = EmailFileProcessor(db)
-        if file.filename.lower().endswith('.pst'):
-            stats = processor.process_pst_file(file_path)
-        else:
-            stats = processor.process_mbox_file(file_path)
-        
-        # Cleanup
-        processor.cleanup_upload(file_path)
-        
-        return {
-            "status": "success",
-            "filename": file.filename,
-            "stats": stats
-        }
-        
+        job = ingestion_jobs.submit(file_path, filename, mailbox_id)
+    except KeyError:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=404, detail="Mailbox not found")
     except Exception as e:
-        # Cleanup on error
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(
             status_code=500,
-            detail=f"Failed to process file: {str(e)}"
+            detail=f"Failed to queue file: {str(e)}"
         )
+    return {
+        "status": "queued",
+        "filename": filename,
+        "job_id": job["job_id"],
+        "mailbox_id": job["mailbox_id"]
+    }
 
-@app.get("/mailboxes")
-def list_mailboxes(db: Session = Depends(get_db)):
-    """List all processed mailboxes"""
-    mailboxes = db.query(models.Mailbox).all()
-    return mailboxes
+def _validate_upload_filename(filename: str) -> None:
+    if not filename or not filename.lower().endswith(('.pst', '.mbox')):
+        raise HTTPException(
+            status_code=400,
+            detail="Only .pst and .mbox files are supported"
+        )
+
+@app.post("/upload")
+async def upload_file(file: UploadFile = File(...), mailbox_id: Optional[int] = None,
+                      db: Session = Depends(get_db)):
+    """Upload a PST or MBOX file and queue it for processing; pass mailbox_id to re-import into an existing mailbox"""
+    _validate_upload_filename(file.filename)
+    _check_mailbox(db, mailbox_id)
+
+    # Stream the upload to disk in fixed-size chunks
+    try:
+        file_path = await upload_service.save_upload(file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    return _queue_uploaded_file(file_path, file.filename, mailbox_id)
+
+@app.post("/uploads")
+def create_upload(filename: str, total_size: Optional[int] = None):
+    """Start a resumable upload for a large PST or MBOX file"""
+    _validate_upload_filename(filename)
+    try:
+        return upload_service.create_session(filename, total_size)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+def get_upload(upload_id: str):
+    """Get the state of a resumable upload, including the offset to resume from"""
+    try:
+        return upload_service.get_session(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request):
+    """Append a chunk of raw bytes to a resumable upload at the given offset"""
+    try:
+        return await upload_service.append_chunk(upload_id, offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/uploads/{upload_id}/complete")
+def complete_upload(upload_id: str, mailbox_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Finish a resumable upload and queue the assembled file for processing"""
+    _check_mailbox(db, mailbox_id)
+    try:
+        file_path, filename = upload_service.complete_session(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return _queue_uploaded_file(file_path, filename, mailbox_id)
+
+@app.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str):
+    """Discard a resumable upload"""
+    upload_service.abort_session(upload_id)
+    return {"status": "aborted", "upload_id": upload_id}
+
+@app.get("/jobs")
+def list_jobs():
+    """List ingestion jobs and their progress"""
+    return ingestion_jobs.list()
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Get progress of an ingestion job"""
+    job = ingestion_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str, interval: float = 1.0):
+    """Stream ingestion job progress as server-sent events until it finishes"""
+    if not ingestion_jobs.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        while True:
+            job = await run_in_threadpool(ingestion_jobs.get, job_id)
+            yield f"data: {json.dumps(job)}\n\n"
+            if job["status"] in ("completed", "failed"):
+                break
+            await asyncio.sleep(max(interval, 0.1))
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def _keyset_page(db: Session, model, schema, after_id: int, limit: int,
+                 fields: Optional[str], with_total: bool) -> Response:
+    """One page of a table in id order, starting after after_id.
+
+    Only the requested columns are selected, and the page is encoded
+    straight to JSON by pydantic instead of FastAPI's generic encoder.
+    """
+    columns = ["id"]
+    if fields:
+        for field in (name.strip() for name in fields.split(",")):
+            if field not in schema.model_fields:
+                raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+            if field not in columns:
+                columns.append(field)
+    else:
+        columns = list(schema.model_fields)
+    limit = max(1, min(limit, settings.list_page_max))
+
+    # Fetch one extra row to know whether another page exists
+    rows = db.execute(
+        select(*[getattr(model, column) for column in columns])
+        .where(model.id > after_id).order_by(model.id).limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    items = [schema.model_construct(**row._mapping) for row in rows[:limit]]
+    page = schemas.Page[schema].model_construct(
+        items=items,
+        next_after_id=items[-1].id if has_more else None,
+        has_more=has_more,
+        total=db.scalar(select(func.count()).select_from(model)) if with_total else None
+    )
+    return Response(
+        content=page.model_dump_json(include={
+            "items": {"__all__": set(columns)}, "next_after_id": True, "has_more": True, "total": True
+        }),
+        media_type="application/json"
+    )
+
+@app.get("/mailboxes", response_model=schemas.Page[schemas.MailboxSummary])
+def list_mailboxes(after_id: int = 0, limit: int = 100, fields: Optional[str] = None,
+                   with_total: bool = False, db: Session = Depends(get_db)):
+    """List processed mailboxes, a page at a time (see _keyset_page)"""
+    return _keyset_page(db, models.Mailbox, schemas.MailboxSummary, after_id, limit, fields, with_total)
 
 @app.post("/process-attachments")
 def process_attachments(db: Session = Depends(get_db)):
-    """Process all unprocessed attachments and extract text"""
-    text_service = TextExtractionService()
+    """Extract text once per unique attachment payload that hasn't been processed yet"""
+    text_service = TextExtractionService(db)
     try:
-        attachments = db.query(models.Attachment).filter(
-            models.Attachment.processed == False
-        ).all()
-        
-        for attachment in attachments:
-            try:
-                extracted_text = text_service.extract_text(attachment.storage_path)
-                attachment.extracted_text = extracted_text
-                attachment.processed = True
-                db.add(attachment)
-            except Exception as e:
-                print(f"Failed to process attachment {attachment.id}: {str(e)}")
-        
-        db.commit()
-        return {"status": "success", "processed": len(attachments)}
+        results = text_service.process_unextracted_attachments()
+        return {"status": "success", **results}
         
     except Exception as e:
         db.rollback()
@@ -119,22 +250,81 @@ def process_attachments(db: Session = Depends(get_db)):
             detail=f"Failed to process attachments: {str(e)}"
         )
 
-@app.get("/organizations")
-def get_organizations(db: Session = Depends(get_db)):
-    """Get list of organizations from email domains"""
-    return db.query(models.Organization).all()
+@app.post("/embeddings")
+def build_embeddings(db: Session = Depends(get_db)):
+    """Embed emails added since the last run into the semantic search index"""
+    try:
+        results = EmbeddingService(db, vector_index, embedding_backend).embed_pending()
+        return {"status": "success", **results}
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to build embeddings: {str(e)}"
+        )
+
+@app.get("/organizations", response_model=schemas.Page[schemas.Organization])
+def get_organizations(after_id: int = 0, limit: int = 100, fields: Optional[str] = None,
+                      with_total: bool = False, db: Session = Depends(get_db)):
+    """Get organizations from email domains, a page at a time"""
+    return _keyset_page(db, models.Organization, schemas.Organization, after_id, limit, fields, with_total)
 
-@app.get("/contacts")
-def get_contacts(db: Session = Depends(get_db)):
-    """Get list of contacts from emails"""
-    return db.query(models.Contact).all()
+@app.get("/contacts", response_model=schemas.Page[schemas.Contact])
+def get_contacts(after_id: int = 0, limit: int = 100, fields: Optional[str] = None,
+                 with_total: bool = False, db: Session = Depends(get_db)):
+    """Get contacts from emails, a page at a time"""
+    return _keyset_page(db, models.Contact, schemas.Contact, after_id, limit, fields, with_total)
 
 llm_analyzer = LLMAnalyzer()
+analysis_jobs = BulkAnalysisManager()
+
+@app.on_event("shutdown")
+async def shutdown_analysis():
+    analysis_jobs.shutdown()
+    await llm_analyzer.provider.close()
+
+def _llm_cache(db: Session) -> LLMResultCache:
+    return LLMResultCache(db, llm_analyzer.model, llm_analyzer.prompt_version)
+
+@app.on_event("startup")
+def purge_expired_analyses():
+    """Drop cached analyses past their TTL; bulk analysis jobs also purge when they finish"""
+    db = SessionLocal()
+    try:
+        _llm_cache(db).purge_expired()
+    finally:
+        db.close()
+
+@app.post("/analysis-jobs")
+def start_analysis_job(mailbox_id: Optional[int] = None):
+    """Analyze every unprocessed email, optionally of one mailbox, in the background"""
+    return analysis_jobs.submit(mailbox_id)
+
+@app.get("/analysis-jobs")
+def list_analysis_jobs():
+    """List bulk analysis jobs and their progress"""
+    return analysis_jobs.list()
+
+@app.get("/analysis-jobs/{job_id}")
+def get_analysis_job(job_id: str):
+    """Get progress of a bulk analysis job"""
+    job = analysis_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/analysis-jobs/{job_id}")
+def cancel_analysis_job(job_id: str):
+    """Stop a bulk analysis job once its in-flight requests finish"""
+    job = analysis_jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.get("/emails/{email_id}/analysis")
-async def analyze_email(email_id: int, db: Session = Depends(get_db)) -> EmailAnalysis:
+async def analyze_email(email_id: int, refresh: bool = False, db: Session = Depends(get_db)) -> EmailAnalysis:
     """
     Analyze a single email using LLM to extract insights.
+    Results are cached until the email changes; pass refresh=true to re-run.
     """
     email = db.query(models.Email).filter(models.Email.id == email_id).first()
     if not email:
@@ -142,71 +332,246 @@ async def analyze_email(email_id: int, db: Session = Depends(get_db)) -> EmailAn
 
     # Get sender and recipients
     sender = db.query(models.Contact).filter(models.Contact.id == email.sender_id).first()
-    recipients = []  # You'll need to implement recipient tracking in your models
+    recipients = load_recipients(db, [email_id]).get(email_id, [])
 
-    analysis = await llm_analyzer.analyze_email(
-        subject=email.subject,
-        body=email.body,
-        sender=sender.email if sender else "",
-        recipients=recipients
+    payload = {
+        "subject": email.subject or "",
+        "body": email.body or "",
+        "sender": sender.email if sender else "",
+        "recipients": recipients
+    }
+    return await _llm_cache(db).get_or_analyze(
+        "email", f"email:{email_id}", payload,
+        lambda: llm_analyzer.analyze_email(**payload),
+        refresh=refresh
     )
-    return analysis
 
-@app.get("/threads/{thread_id}/analysis")
-async def analyze_thread(thread_id: str, db: Session = Depends(get_db)):
-    """
-    Analyze an email thread using LLM.
-    """
-    # You'll need to implement thread tracking in your models
-    emails = db.query(models.Email).filter(models.Email.thread_id == thread_id).all()
+def _thread_emails(db: Session, thread_id: str) -> List[Dict]:
+    emails = db.query(
+        models.Email.fingerprint,
+        models.Email.received_date,
+        models.Email.subject,
+        models.Email.body,
+        models.Contact.email.label("sender")
+    ).outerjoin(models.Contact, models.Contact.id == models.Email.sender_id).filter(
+        models.Email.thread_id == thread_id
+    ).order_by(models.Email.received_date, models.Email.id).all()
     if not emails:
         raise HTTPException(status_code=404, detail="Thread not found")
 
+    # A message imported into several mailboxes appears once
+    seen = set()
     thread_emails = []
     for email in emails:
-        sender = db.query(models.Contact).filter(models.Contact.id == email.sender_id).first()
+        if email.fingerprint in seen:
+            continue
+        seen.add(email.fingerprint)
         thread_emails.append({
-            "sender": sender.email if sender else "",
+            "sender": email.sender or "",
             "timestamp": email.received_date,
             "subject": email.subject,
             "body": email.body
         })
+    return thread_emails
+
+def _attachment_content(db: Session, attachment_id: int) -> Tuple[models.Attachment, str]:
+    attachment = db.query(models.Attachment).filter(models.Attachment.id == attachment_id).first()
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+
+    # Only the first pages the prompt can use are read or parsed
+    try:
+        content = TextExtractionService(db).read_text(
+            attachment, max_chars=llm_analyzer.attachment_char_limit
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read attachment: {str(e)}")
+    if not content:
+        raise HTTPException(status_code=400, detail="No text could be extracted from attachment")
+    return attachment, content
+
+def _sse(data: Dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, default=str)}\n\n"
+
+def _stream_analysis(db: Session, kind: str, subject: str, payload, stream: Callable[[], AsyncIterator[str]],
+                     build_result: Callable[[str], Dict], refresh: bool) -> StreamingResponse:
+    """Stream an analysis as server-sent events: "data" events carry text deltas,
+    a final "result" event the complete result, which is also cached.
+    A cached result is sent as the only event."""
+    cached = None if refresh else _llm_cache(db).get(kind, payload)
+
+    async def events():
+        if cached is not None:
+            yield _sse(cached, "result")
+            return
+        parts = []
+        try:
+            async for delta in stream():
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        except Exception as e:
+            yield _sse({"detail": str(e)}, "error")
+            return
+
+        result = build_result("".join(parts))
+
+        # The request's session is closed once streaming starts
+        def save():
+            session = SessionLocal()
+            try:
+                _llm_cache(session).put(kind, subject, payload, result)
+            finally:
+                session.close()
+        await run_in_threadpool(save)
+        yield _sse(result, "result")
 
-    analysis = await llm_analyzer.analyze_thread(thread_emails)
-    return analysis
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/threads/{thread_id}/analysis")
+async def analyze_thread(thread_id: str, refresh: bool = False, db: Session = Depends(get_db)):
+    """
+    Analyze an email thread using LLM.
+    Results are cached until the thread changes; pass refresh=true to re-run.
+    """
+    thread_emails = _thread_emails(db, thread_id)
+    return await _llm_cache(db).get_or_analyze(
+        "thread", f"thread:{thread_id}", thread_emails,
+        lambda: llm_analyzer.analyze_thread(thread_emails),
+        refresh=refresh
+    )
+
+@app.get("/threads/{thread_id}/analysis/stream")
+def stream_thread_analysis(thread_id: str, refresh: bool = False, db: Session = Depends(get_db)):
+    """
+    Analyze an email thread, streaming the analysis as server-sent events.
+    """
+    thread_emails = _thread_emails(db, thread_id)
+    # Filled in while streaming, so the result and its cache entry match /threads/{id}/analysis
+    fields = {}
+    return _stream_analysis(
+        db, "thread", f"thread:{thread_id}", thread_emails,
+        lambda: llm_analyzer.stream_thread_analysis(thread_emails, fields),
+        lambda text: {"analysis": text, **fields},
+        refresh
+    )
 
 @app.get("/attachments/{attachment_id}/analysis")
-async def analyze_attachment(attachment_id: int, db: Session = Depends(get_db)):
+async def analyze_attachment(attachment_id: int, refresh: bool = False, db: Session = Depends(get_db)):
     """
     Analyze an email attachment using LLM.
+    Results are cached until the attachment text changes; pass refresh=true to re-run.
+    """
+    # Reading the text may parse a PDF or DOCX, so keep it off the event loop
+    attachment, content = await run_in_threadpool(_attachment_content, db, attachment_id)
+    return await _llm_cache(db).get_or_analyze(
+        "attachment", f"attachment:{attachment_id}",
+        {"filename": attachment.filename, "content": content},
+        lambda: llm_analyzer.analyze_attachment_content(content, attachment.filename),
+        refresh=refresh
+    )
+
+@app.get("/attachments/{attachment_id}/analysis/stream")
+def stream_attachment_analysis(attachment_id: int, refresh: bool = False, db: Session = Depends(get_db)):
+    """
+    Analyze an email attachment, streaming the analysis as server-sent events.
+    """
+    attachment, content = _attachment_content(db, attachment_id)
+    filename = attachment.filename
+    return _stream_analysis(
+        db, "attachment", f"attachment:{attachment_id}",
+        {"filename": filename, "content": content},
+        lambda: llm_analyzer.stream_attachment_analysis(content, filename),
+        lambda text: {"analysis": text, "filename": filename},
+        refresh
+    )
+
+@app.get("/attachments/{attachment_id}/pages")
+def get_attachment_pages(attachment_id: int, start: int = 1, end: Optional[int] = None,
+                         db: Session = Depends(get_db)):
+    """
+    Read stored per-page text of a multi-page attachment without re-parsing it.
     """
     attachment = db.query(models.Attachment).filter(models.Attachment.id == attachment_id).first()
     if not attachment:
         raise HTTPException(status_code=404, detail="Attachment not found")
+    if not attachment.blob:
+        raise HTTPException(status_code=404, detail="No stored pages for attachment")
 
-    # Read attachment content
-    file_path = os.path.join(settings.ATTACHMENT_STORAGE_PATH, attachment.file_path)
-    try:
-        with open(file_path, 'r') as f:
-            content = f.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Could not read attachment: {str(e)}")
-
-    analysis = await llm_analyzer.analyze_attachment_content(content, attachment.filename)
-    return analysis
+    pages = TextExtractionService(db).read_pages(attachment.blob.id, start, end)
+    return {
+        "attachment_id": attachment_id,
+        "pages": [{"page_number": number, "text": text} for number, text in pages]
+    }
 
 @app.get("/emails/search")
-async def semantic_search(
+def search_emails(
     query: str,
     limit: int = 10,
+    offset: int = 0,
+    mode: str = "fulltext",
     db: Session = Depends(get_db)
 ):
     """
-    Perform semantic search across emails using LLM embeddings.
+    Search emails, best matches first.
+    
+    "fulltext" ranks keyword matches over subjects, bodies and attachment
+    text; "semantic" ranks by embedding similarity (see POST /embeddings).
     """
-    # This would be implemented using embeddings for better performance
-    # For now, we'll use the LLM to analyze the query and find relevant emails
-    raise HTTPException(status_code=501, detail="Semantic search not yet implemented")
+    if not query.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    if mode not in ("fulltext", "semantic"):
+        raise HTTPException(status_code=400, detail="mode must be 'fulltext' or 'semantic'")
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+
+    # Fetch one extra hit to know whether another page exists
+    if mode == "semantic":
+        hits = EmbeddingService(db, vector_index, embedding_backend).search(query, limit=limit + 1, offset=offset)
+    else:
+        hits = SearchIndex(db).search(query, limit=limit + 1, offset=offset)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    emails = {
+        row.id: row for row in db.query(
+            models.Email.id,
+            models.Email.subject,
+            models.Email.received_date,
+            models.Email.mailbox_id,
+            models.Email.thread_id,
+            models.Contact.email.label("sender")
+        ).outerjoin(models.Contact, models.Contact.id == models.Email.sender_id)
+        .filter(models.Email.id.in_([hit["email_id"] for hit in hits]))
+    }
+    results = []
+    for hit in hits:
+        email = emails.get(hit["email_id"])
+        if not email:
+            continue
+        results.append({
+            "id": email.id,
+            "subject": email.subject,
+            "sender": email.sender,
+            "received_date": email.received_date,
+            "mailbox_id": email.mailbox_id,
+            "thread_id": email.thread_id,
+            "score": hit["score"],
+            "snippet": hit.get("snippet")
+        })
+
+    return {
+        "query": query,
+        "limit": limit,
+        "offset": offset,
+        "mode": mode,
+        "has_more": has_more,
+        "results": results
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.sqlite import JSON
 from database import Base
@@ -38,16 +38,42 @@ class Mailbox(Base):
     
     emails = relationship("Email", back_populates="mailbox")
 
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    
+    id = Column(String, primary_key=True)  # uuid hex, returned by /upload
+    mailbox_id = Column(Integer, ForeignKey("mailboxes.id"), index=True)
+    file_path = Column(String)  # uploaded file, removed when the job finishes
+    filename = Column(String)
+    status = Column(String, default="queued", index=True)  # 'queued', 'running', 'completed' or 'failed'
+    error = Column(Text, nullable=True)
+    messages_seen = Column(Integer, default=0)  # written, skipped or failed in this run
+    skipped_messages = Column(Integer, default=0)
+    attachments = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    mailbox = relationship("Mailbox")
+
 class Email(Base):
     __tablename__ = "emails"
+    # A message is stored once per mailbox; the same message in two archives gets a row in each
+    __table_args__ = (UniqueConstraint("mailbox_id", "fingerprint", name="uq_emails_mailbox_fingerprint"),)
     
     id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String, index=True, nullable=True)  # Message-ID or content hash, see message_fingerprint
+    message_id = Column(String, index=True, nullable=True)  # normalized Message-ID header
+    in_reply_to = Column(String, nullable=True)
+    references = Column(Text, nullable=True)  # space-separated Message-IDs, oldest first
+    thread_id = Column(String, index=True, nullable=True)  # conversation, see ThreadIndex
     subject = Column(String)
     sender_id = Column(Integer, ForeignKey("contacts.id"))
     received_date = Column(DateTime)
     body = Column(Text)
     importance = Column(String)
     processed = Column(Boolean, default=False)
+    embedding_stale = Column(Boolean, default=False, index=True)  # attachment text changed after the email was embedded
     mailbox_id = Column(Integer, ForeignKey("mailboxes.id"))
     org_id = Column(Integer, ForeignKey("organizations.id"), nullable=True)
     
@@ -57,6 +83,13 @@ class Email(Base):
     recipients = relationship("Contact", secondary="email_recipients", back_populates="emails_received")
     attachments = relationship("Attachment", back_populates="email")
 
+class ThreadKey(Base):
+    __tablename__ = "thread_keys"
+    
+    key = Column(String, primary_key=True)  # a Message-ID, or 'subject:' plus a normalized subject
+    thread_id = Column(String, index=True)
+    last_date = Column(DateTime, nullable=True)  # latest email on a subject key, for the subject fallback window
+
 class EmailRecipient(Base):
     __tablename__ = "email_recipients"
     
@@ -64,14 +97,58 @@ class EmailRecipient(Base):
     contact_id = Column(Integer, ForeignKey("contacts.id"), primary_key=True)
     recipient_type = Column(String)  # 'to', 'cc', or 'bcc'
 
+class AttachmentBlob(Base):
+    __tablename__ = "attachment_blobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String, unique=True, index=True)
+    storage_path = Column(String)
+    size = Column(Integer)
+    content_type = Column(String, nullable=True)
+    processed = Column(Boolean, default=False)
+    extracted_text = Column(Text, nullable=True)
+    extractor_version = Column(String, nullable=True, index=True)  # Extractor.tag that produced extracted_text
+    extraction_error = Column(Text, nullable=True)  # set when extraction was killed or crashed a worker
+    
+    attachments = relationship("Attachment", back_populates="blob")
+    pages = relationship("AttachmentPage", back_populates="blob", order_by="AttachmentPage.page_number")
+
+class AttachmentPage(Base):
+    __tablename__ = "attachment_pages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    blob_id = Column(Integer, ForeignKey("attachment_blobs.id"), index=True)
+    page_number = Column(Integer)
+    text = Column(Text)
+    
+    blob = relationship("AttachmentBlob", back_populates="pages")
+
 class Attachment(Base):
     __tablename__ = "attachments"
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String)
     storage_path = Column(String)
+    content_hash = Column(String, ForeignKey("attachment_blobs.sha256"), index=True, nullable=True)
+    content_type = Column(String, nullable=True)
+    size = Column(Integer, nullable=True)
+    truncated = Column(Boolean, default=False)  # stored data cut at max_attachment_size
     processed = Column(Boolean, default=False)
     extracted_text = Column(Text, nullable=True)
     email_id = Column(Integer, ForeignKey("emails.id"))
     
     email = relationship("Email", back_populates="attachments")
+    blob = relationship("AttachmentBlob", back_populates="attachments")
+
+class LLMResult(Base):
+    __tablename__ = "llm_results"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String)  # 'email', 'email_batch' (batched prompt), 'thread' or 'attachment'
+    subject = Column(String, index=True)  # what was analyzed, e.g. 'email:42'
+    model = Column(String)
+    prompt_version = Column(String)  # LLMAnalyzer.prompt_version the result was produced with
+    input_hash = Column(String, index=True)  # SHA-256 of the normalized prompt input
+    result = Column(Text)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True, index=True)
@@ -1,7 +1,9 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Generic, List, Optional, TypeVar
 from datetime import datetime
 
+T = TypeVar("T")
+
 class EmailBase(BaseModel):
     subject: str
     sender: str
@@ -37,3 +39,30 @@ class Mailbox(MailboxBase):
 
     class Config:
         from_attributes = True
+
+# List endpoint rows. Every field but id is optional so a page can carry
+# only the columns requested with ?fields=
+class Organization(BaseModel):
+    id: int
+    name: Optional[str] = None
+    domain: Optional[str] = None
+
+class Contact(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+    organization_id: Optional[int] = None
+
+class MailboxSummary(BaseModel):
+    id: int
+    name: Optional[str] = None
+    type: Optional[str] = None
+    last_processed: Optional[datetime] = None
+    total_messages: Optional[int] = None
+    processed_messages: Optional[int] = None
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_after_id: Optional[int] = None  # pass as after_id to fetch the next page
+    has_more: bool
+    total: Optional[int] = None  # only when requested with ?with_total=true
@@ -0,0 +1,48 @@
+import os
+import uuid
+import hashlib
+from typing import Dict, Any, Iterable
+from config import settings
+
+class AttachmentStore:
+    """Content-addressed attachment storage.
+
+    Payloads are keyed by their SHA-256 and sharded two levels deep
+    (ab/cd/abcd...), so identical attachments are written once and
+    same-named files never overwrite each other.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or settings.attachment_storage_path
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put_stream(self, chunks: Iterable[bytes]) -> Dict[str, Any]:
+        """Store a payload from an iterable of chunks, hashing it as it is written."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+
+            sha256 = digest.hexdigest()
+            path = self.path_for(sha256)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Atomic, so concurrent writers of the same payload are harmless
+                os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return {'sha256': sha256, 'path': path, 'size': size}
@@ -0,0 +1,353 @@
+import time
+import uuid
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+from collections import defaultdict
+from sqlalchemy import select, update, bindparam, case
+from sqlalchemy.orm import Session
+import models
+from database import SessionLocal
+from config import settings
+from services.llm_analyzer import LLMAnalyzer
+from services.llm_cache import LLMResultCache
+from services.tokens import count_tokens
+from services.identity_cache import chunked
+
+# Completion tokens reserved per request when charging the token budget
+COMPLETION_TOKENS = 1000
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) == 429 or type(error).__name__ == 'RateLimitError'
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from the Retry-After header of a 429 response."""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+def email_tokens(payload: Dict[str, Any]) -> int:
+    return count_tokens(payload["subject"]) + count_tokens(payload["body"])
+
+def pack_batches(emails: List[Tuple[int, Dict[str, Any]]]) -> List[List[Tuple[int, Dict[str, Any]]]]:
+    """Group emails into multi-email requests of at most analysis_batch_tokens prompt tokens.
+
+    Emails are packed in order; one that alone exceeds half the budget is
+    sent on its own, where the full single-email prompt serves it better.
+    """
+    budget = settings.analysis_batch_tokens
+    max_emails = max(1, settings.analysis_batch_max_emails)
+    batches = []
+    current, current_tokens = [], 0
+    for email in emails:
+        cost = email_tokens(email[1])
+        if max_emails == 1 or cost > budget // 2:
+            batches.append([email])
+            continue
+        if current and (current_tokens + cost > budget or len(current) >= max_emails):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(email)
+        current_tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+def load_recipients(db: Session, email_ids: List[int]) -> Dict[int, List[str]]:
+    """Recipient addresses per email, To before Cc before Bcc, in one query per chunk of ids."""
+    recipients: Dict[int, List[str]] = defaultdict(list)
+    order = case({'to': 0, 'cc': 1}, value=models.EmailRecipient.recipient_type, else_=2)
+    for chunk in chunked(email_ids):
+        rows = db.execute(
+            select(models.EmailRecipient.email_id, models.Contact.email)
+            .join(models.Contact, models.Contact.id == models.EmailRecipient.contact_id)
+            .where(models.EmailRecipient.email_id.in_(chunk))
+            .order_by(models.EmailRecipient.email_id, order, models.Contact.email)
+        )
+        for email_id, address in rows:
+            recipients[email_id].append(address)
+    return recipients
+
+class RateLimiter:
+    """Token bucket refilled continuously at per_minute units per minute; 0 disables it."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.available = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: int = 1) -> None:
+        if self.capacity <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+class AnalysisJob:
+    def __init__(self, mailbox_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.mailbox_id = mailbox_id
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.cancelled = False
+        self.stats: Dict[str, int] = {
+            "total": 0, "analyzed": 0, "cached": 0, "failed": 0, "retries": 0
+        }
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+class BulkAnalysisManager:
+    """Runs LLM analysis over every unprocessed email as background jobs.
+
+    Each job drives its own event loop in a worker thread. An asyncio
+    semaphore bounds requests in flight, short emails are packed several to
+    a request (see pack_batches), and request- and token-per-minute
+    buckets keep the job under the provider's limits; 429 responses are
+    retried with jittered exponential backoff. Emails triaged as 'low'
+    importance are skipped unless analysis_skip_low_importance is off.
+    Results go to the LLM result cache and the emails are marked processed,
+    so an interrupted job picks up where it stopped.
+    """
+
+    def __init__(self, analyzer_factory: Callable[[], LLMAnalyzer] = LLMAnalyzer, max_workers: int = None):
+        # Each job gets its own analyzer: the provider's HTTP pool belongs to the job's event loop
+        self.analyzer_factory = analyzer_factory
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.analysis_workers,
+            thread_name_prefix="analysis"
+        )
+        self.jobs: Dict[str, AnalysisJob] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, mailbox_id: Optional[int] = None) -> Dict[str, Any]:
+        """Queue analysis of the unprocessed emails, optionally of one mailbox."""
+        job = AnalysisJob(mailbox_id)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        return self.get(job.id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a progress snapshot for a job, or None if it is unknown."""
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+
+        elapsed = 0.0
+        if job.started_at:
+            elapsed = (job.finished_at or time.monotonic()) - job.started_at
+        done = job.stats["analyzed"] + job.stats["cached"]
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "mailbox_id": job.mailbox_id,
+            "created_at": job.created_at.isoformat(),
+            **job.stats,
+            "elapsed_seconds": round(elapsed, 2),
+            "emails_per_minute": round(done / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "error": job.error
+        }
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [self.get(job_id) for job_id in list(self.jobs)]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Stop a job after its in-flight requests finish."""
+        job = self.jobs.get(job_id)
+        if not job:
+            return None
+        job.cancelled = True
+        return self.get(job_id)
+
+    def shutdown(self) -> None:
+        for job in self.jobs.values():
+            job.cancelled = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: AnalysisJob) -> None:
+        job.status = "running"
+        job.started_at = time.monotonic()
+        db = SessionLocal()
+        try:
+            asyncio.run(self._analyze_all(job, db, self.analyzer_factory()))
+            job.status = "cancelled" if job.cancelled else "completed"
+        except Exception as e:
+            print(f"Analysis job {job.id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.monotonic()
+            db.close()
+
+    async def _analyze_all(self, job: AnalysisJob, db: Session, analyzer: LLMAnalyzer) -> None:
+        try:
+            await self._analyze_pages(job, db, analyzer)
+        finally:
+            await analyzer.provider.close()
+
+    async def _analyze_pages(self, job: AnalysisJob, db: Session, analyzer: LLMAnalyzer) -> None:
+        cache = LLMResultCache(db, analyzer.model, analyzer.prompt_version)
+        semaphore = asyncio.Semaphore(settings.analysis_concurrency)
+        requests = RateLimiter(settings.llm_requests_per_minute)
+        tokens = RateLimiter(settings.llm_tokens_per_minute)
+        pending = set()
+        done: List[tuple] = []
+
+        async def analyze_one(email_id: int, payload: Dict[str, Any]) -> None:
+            try:
+                result = await self._with_retries(
+                    job, lambda: analyzer.analyze_email(**payload),
+                    requests, tokens, email_tokens(payload) + COMPLETION_TOKENS
+                )
+                job.stats["analyzed"] += 1
+                done.append((email_id, payload, result, "email"))
+            except Exception as e:
+                job.stats["failed"] += 1
+                print(f"Error analyzing email {email_id}: {e}")
+
+        async def analyze(batch: List[Tuple[int, Dict[str, Any]]]) -> None:
+            try:
+                if len(batch) == 1:
+                    await analyze_one(*batch[0])
+                    return
+                payloads = [payload for _, payload in batch]
+                try:
+                    results = await self._with_retries(
+                        job, lambda: analyzer.analyze_email_batch(payloads), requests, tokens,
+                        sum(email_tokens(payload) for payload in payloads)
+                        + analyzer.batch_tokens_per_email * len(payloads)
+                    )
+                except Exception as e:
+                    print(f"Error analyzing batch of {len(batch)} emails, retrying individually: {e}")
+                    results = [None] * len(batch)
+                for (email_id, payload), result in zip(batch, results):
+                    if result is None:
+                        # Missing from the batched answer: fall back to a single-email request
+                        await analyze_one(email_id, payload)
+                    else:
+                        job.stats["analyzed"] += 1
+                        # The batch prompt differs from the single-email one, so its results are cached apart
+                        done.append((email_id, payload, result, "email_batch"))
+            finally:
+                semaphore.release()
+
+        last_id = 0
+        while not job.cancelled:
+            emails = self._load_page(db, job, last_id)
+            if not emails:
+                break
+            last_id = emails[-1][0]
+            job.stats["total"] += len(emails)
+
+            uncached = []
+            for email_id, payload in emails:
+                for kind in ("email", "email_batch"):
+                    cached = cache.get(kind, payload)
+                    if cached is not None:
+                        break
+                if cached is None:
+                    uncached.append((email_id, payload))
+                else:
+                    job.stats["cached"] += 1
+                    done.append((email_id, payload, cached, kind))
+
+            for batch in pack_batches(uncached):
+                await semaphore.acquire()
+                if job.cancelled:
+                    semaphore.release()
+                    break
+                task = asyncio.create_task(analyze(batch))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                if len(done) >= settings.analysis_concurrency * 4:
+                    self._save(db, cache, done)
+                    done = []
+
+            # Keep the last page's results from waiting on the next page load
+            self._save(db, cache, done)
+            done = []
+
+        if pending:
+            await asyncio.gather(*pending)
+        self._save(db, cache, done)
+        # Results are otherwise only replaced when re-analyzed, so expired rows would pile up
+        cache.purge_expired()
+
+    async def _with_retries(self, job: AnalysisJob, call: Callable[[], Awaitable[Any]],
+                            requests: RateLimiter, tokens: RateLimiter, token_cost: int) -> Any:
+        """Run one LLM call under the rate limits, backing off and retrying on 429 responses."""
+        for attempt in range(settings.llm_max_retries + 1):
+            await requests.acquire()
+            await tokens.acquire(token_cost)
+            try:
+                return await call()
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == settings.llm_max_retries:
+                    raise
+                job.stats["retries"] += 1
+                delay = retry_after(e) or min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                await asyncio.sleep(delay)
+
+    def _load_page(self, db: Session, job: AnalysisJob, last_id: int) -> List[Tuple[int, Dict[str, Any]]]:
+        query = select(
+            models.Email.id,
+            models.Email.subject,
+            models.Email.body,
+            models.Contact.email.label("sender")
+        ).outerjoin(models.Contact, models.Contact.id == models.Email.sender_id).where(
+            models.Email.processed == False,
+            models.Email.id > last_id
+        )
+        if job.mailbox_id is not None:
+            query = query.where(models.Email.mailbox_id == job.mailbox_id)
+        if settings.analysis_skip_low_importance:
+            # Newsletters and automated mail, as tagged by triage at ingestion
+            query = query.where(models.Email.importance != 'low')
+        rows = db.execute(query.order_by(models.Email.id).limit(settings.analysis_batch_size)).all()
+        recipients = load_recipients(db, [row.id for row in rows])
+        # Same payload as the single-email endpoint, so its cached results are reused here
+        return [
+            (row.id, {
+                "subject": row.subject or "",
+                "body": row.body or "",
+                "sender": row.sender or "",
+                "recipients": recipients.get(row.id, [])
+            })
+            for row in rows
+        ]
+
+    def _save(self, db: Session, cache: LLMResultCache, done: List[tuple]) -> None:
+        """Persist finished analyses and mark their emails processed in one transaction."""
+        if not done:
+            return
+        try:
+            for kind in ("email", "email_batch"):
+                cache.put_many(kind, [
+                    (f"email:{email_id}", payload, result)
+                    for email_id, payload, result, result_kind in done if result_kind == kind
+                ])
+            email_table = models.Email.__table__
+            db.execute(
+                update(email_table).where(email_table.c.id == bindparam("email_id")).values(processed=True),
+                [{"email_id": email_id} for email_id, _, _, _ in done]
+            )
+            db.commit()
+        except Exception as e:
+            print(f"Error saving {len(done)} email analyses: {e}")
+            db.rollback()
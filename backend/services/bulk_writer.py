@@ -0,0 +1,230 @@
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+import models
+from config import settings
+from database import engine
+from services.identity_cache import IdentityCache, chunked
+from services.search_index import SearchIndex
+from services.thread_index import ThreadIndex
+from services.triage import TriageClassifier
+
+class StoredFingerprints:
+    """Tells the parser which messages a mailbox already stores, before their attachments are read.
+
+    Holds only the mailbox id so it can be handed to parser pool workers;
+    each check runs on a short-lived connection, so workers never keep a
+    read transaction open against the writer.
+    """
+
+    def __init__(self, mailbox_id: int):
+        self.mailbox_id = mailbox_id
+
+    def __call__(self, fingerprint: str) -> bool:
+        with engine.connect() as connection:
+            return connection.scalar(
+                select(models.Email.id).where(
+                    models.Email.mailbox_id == self.mailbox_id,
+                    models.Email.fingerprint == fingerprint
+                ).limit(1)
+            ) is not None
+
+class EmailBulkWriter:
+    """Buffers parsed emails and writes them in batches, one transaction per batch."""
+
+    def __init__(self, db: Session, mailbox_id: int, batch_size: Optional[int] = None):
+        self.db = db
+        self.mailbox_id = mailbox_id
+        self.batch_size = batch_size or settings.ingestion_batch_size
+        self.identities = IdentityCache(db)
+        self.identities.prewarm()
+        self.search = SearchIndex(db)
+        self.triage = TriageClassifier()
+        self.threads = ThreadIndex(db)
+        self.buffer: List[Dict[str, Any]] = []
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self.attachments = 0
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """Buffer a parsed email, flushing once the batch is full."""
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all buffered emails. A failing batch is retried row by row."""
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            self._rollback()
+            print(f"Batch insert of {len(batch)} emails failed, retrying individually: {e}")
+            for record in batch:
+                try:
+                    self._write_batch([record])
+                except Exception as e:
+                    self._rollback()
+                    self.failed += 1
+                    print(f"Error processing message: {e}")
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        batch, duplicates = self._drop_known(batch)
+        if not batch:
+            self.skipped += duplicates
+            return
+
+        # Senders and recipients resolve together: one lookup and at most one insert per batch
+        contacts = self.identities.resolve_contacts(
+            [(record['sender'], record.get('sender_name')) for record in batch]
+            + [(address, name) for record in batch for address, name, _ in record.get('recipients', [])]
+        )
+
+        importances = self.triage.classify(batch)
+        thread_ids = self.threads.assign(batch)
+
+        email_rows = []
+        for record, importance, thread_id in zip(batch, importances, thread_ids):
+            contact_id, org_id = contacts[record['sender']]
+            email_rows.append({
+                'fingerprint': record['fingerprint'],
+                'message_id': record.get('message_id'),
+                'in_reply_to': record.get('in_reply_to'),
+                'references': " ".join(record.get('references') or []) or None,
+                'thread_id': thread_id,
+                'subject': record['subject'],
+                'sender_id': contact_id,
+                'received_date': record['received_date'],
+                'body': record['body'],
+                'importance': importance,
+                'processed': False,
+                'mailbox_id': self.mailbox_id,
+                'org_id': org_id
+            })
+        email_ids = self.db.scalars(
+            insert(models.Email).returning(models.Email.id, sort_by_parameter_order=True),
+            email_rows
+        ).all()
+
+        recipient_rows = [
+            {'email_id': email_id, 'contact_id': contacts[address][0], 'recipient_type': recipient_type}
+            for email_id, record in zip(email_ids, batch)
+            for address, _, recipient_type in record.get('recipients', [])
+        ]
+        if recipient_rows:
+            self.db.execute(insert(models.EmailRecipient), recipient_rows)
+
+        attachment_rows = []
+        for email_id, record in zip(email_ids, batch):
+            for attachment_data in record['attachments']:
+                attachment_rows.append({
+                    'email_id': email_id,
+                    'filename': attachment_data['filename'],
+                    'storage_path': attachment_data['path'],
+                    'content_hash': attachment_data.get('sha256'),
+                    'content_type': attachment_data.get('content_type'),
+                    'size': attachment_data.get('size'),
+                    'truncated': attachment_data.get('truncated', False),
+                    # Skipped attachments have no stored data to extract
+                    'processed': attachment_data['path'] is None,
+                    'extracted_text': None
+                })
+        if attachment_rows:
+            self._reference_blobs(attachment_rows)
+            self.db.execute(insert(models.Attachment), attachment_rows)
+
+        attachment_text = defaultdict(list)
+        for row in attachment_rows:
+            if row['extracted_text']:
+                attachment_text[row['email_id']].append(row['extracted_text'])
+        self.search.index_emails([
+            {
+                'id': email_id,
+                'subject': row['subject'],
+                'body': row['body'],
+                'attachments': "\n".join(attachment_text.get(email_id, []))
+            }
+            for email_id, row in zip(email_ids, email_rows)
+        ])
+
+        self.db.commit()
+        self.identities.commit()
+        self.threads.commit()
+        self.written += len(batch)
+        self.skipped += duplicates
+        self.attachments += len(attachment_rows)
+
+    def _rollback(self) -> None:
+        self.db.rollback()
+        self.identities.rollback()
+        self.threads.rollback()
+
+    def _drop_known(self, batch: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+        """Remove messages already in this mailbox (or repeated within the batch) by fingerprint.
+
+        Records the parser marked 'known' were found stored before their
+        attachments were read, and are dropped without another lookup.
+        """
+        fingerprints = list({record['fingerprint'] for record in batch if not record.get('known')})
+        known = set()
+        for chunk in chunked(fingerprints):
+            known.update(self.db.scalars(
+                select(models.Email.fingerprint).where(
+                    models.Email.mailbox_id == self.mailbox_id,
+                    models.Email.fingerprint.in_(chunk)
+                )
+            ))
+
+        fresh = []
+        for record in batch:
+            if record.get('known') or record['fingerprint'] in known:
+                continue
+            known.add(record['fingerprint'])
+            fresh.append(record)
+        return fresh, len(batch) - len(fresh)
+
+    def _reference_blobs(self, attachment_rows: List[Dict[str, Any]]) -> None:
+        """Create the content-addressed blob behind each attachment if it is new.
+
+        Attachments whose payload was already extracted inherit its text.
+        """
+        hashes = list(dict.fromkeys(row['content_hash'] for row in attachment_rows if row['content_hash']))
+        if not hashes:
+            return
+
+        existing = set()
+        extracted = {}
+        for chunk in chunked(hashes):
+            for sha256, processed, extracted_text in self.db.execute(
+                select(
+                    models.AttachmentBlob.sha256,
+                    models.AttachmentBlob.processed,
+                    models.AttachmentBlob.extracted_text
+                ).where(models.AttachmentBlob.sha256.in_(chunk))
+            ):
+                existing.add(sha256)
+                if processed:
+                    extracted[sha256] = extracted_text
+
+        for row in attachment_rows:
+            if row['content_hash'] in extracted:
+                row['processed'] = True
+                row['extracted_text'] = extracted[row['content_hash']]
+
+        new_blobs = {}
+        for row in attachment_rows:
+            sha256 = row['content_hash']
+            if sha256 and sha256 not in existing and sha256 not in new_blobs:
+                new_blobs[sha256] = {
+                    'sha256': sha256,
+                    'storage_path': row['storage_path'],
+                    'size': row['size'],
+                    'content_type': row['content_type'],
+                    'processed': False
+                }
+        if new_blobs:
+            self.db.execute(insert(models.AttachmentBlob), list(new_blobs.values()))
@@ -0,0 +1,170 @@
+import re
+import time
+import hashlib
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+import httpx
+import numpy as np
+import openai
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+import models
+from config import settings
+from services.vector_index import VectorIndex
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+class EmbeddingBackend:
+    """Turns texts into L2-normalized float32 vectors of a fixed dimension."""
+    name = "base"
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """Deterministic local stand-in: signed feature hashing of words and word pairs.
+
+    Needs no network or model download, so tests and offline installs get
+    stable vectors where shared vocabulary means higher cosine similarity.
+    """
+    name = "hashing"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = TOKEN.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for feature in features:
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                vectors[row, value % self.dimension] += 1.0 if value >> 63 else -1.0
+        return self._normalize(vectors)
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Embeddings from the OpenAI API.
+
+    text-embedding-3 models are asked for vectors of the configured
+    dimension; older models have a fixed size (1536 for ada-002) that
+    embedding_dimension must match.
+    """
+    name = "openai"
+
+    def __init__(self, dimension: int, model: Optional[str] = None):
+        super().__init__(dimension)
+        self.model = model or settings.embedding_model
+        # An explicit client, like OpenAIProvider's, so openai does not build one with its own proxy arguments
+        self.client = openai.OpenAI(
+            api_key=settings.openai_api_key,
+            http_client=httpx.Client(timeout=httpx.Timeout(settings.llm_timeout, connect=10.0))
+        )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        # The pinned openai client predates the dimensions argument, so send it in the body
+        extra_body = {"dimensions": self.dimension} if self.model.startswith("text-embedding-3") else None
+        response = self.client.embeddings.create(
+            model=self.model, input=[text or " " for text in texts], extra_body=extra_body
+        )
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"{self.model} returned {vectors.shape[1]}-dimensional vectors, expected {self.dimension}")
+        return self._normalize(vectors)
+
+EMBEDDING_BACKENDS = {
+    HashingEmbeddingBackend.name: HashingEmbeddingBackend,
+    OpenAIEmbeddingBackend.name: OpenAIEmbeddingBackend,
+}
+
+def get_embedding_backend(name: Optional[str] = None, dimension: Optional[int] = None) -> EmbeddingBackend:
+    name = name or settings.embedding_backend
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name}")
+    return EMBEDDING_BACKENDS[name](dimension or settings.embedding_dimension)
+
+class EmbeddingService:
+    """Embeds emails, with their attachment text, into the vector index in id-ordered batches."""
+
+    def __init__(self, db: Session, index: VectorIndex, backend: EmbeddingBackend):
+        self.db = db
+        self.index = index
+        self.backend = backend
+
+    def embed_pending(self, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """Embed every email newer than the last one in the index, then refresh the IVF lists.
+
+        Emails already in the index whose attachment text changed since
+        (embedding_stale) are embedded again and replace their old vectors.
+        """
+        batch_size = batch_size or settings.embedding_batch_size
+        self.index.open(self.backend.name, self.backend.dimension)
+        results = {"embedded": 0, "reembedded": 0}
+        started = time.monotonic()
+
+        watermark = last_id = self.index.last_id()
+        while True:
+            emails = self._load(models.Email.id > last_id, batch_size)
+            if not emails:
+                break
+            last_id = emails[-1].id
+            self._embed(emails)
+            results["embedded"] += len(emails)
+
+        last_id = 0
+        while True:
+            emails = self._load(
+                (models.Email.embedding_stale == True) & (models.Email.id <= watermark) & (models.Email.id > last_id),
+                batch_size
+            )
+            if not emails:
+                break
+            last_id = emails[-1].id
+            self._embed(emails)
+            results["reembedded"] += len(emails)
+
+        results["indexed_lists"] = self.index.train_if_stale()
+        results["total_vectors"] = self.index.count
+        results["elapsed_seconds"] = round(time.monotonic() - started, 2)
+        return results
+
+    def _load(self, condition, batch_size: int) -> List:
+        return self.db.execute(
+            select(models.Email.id, models.Email.subject, models.Email.body)
+            .where(condition).order_by(models.Email.id).limit(batch_size)
+        ).all()
+
+    def _embed(self, emails: List) -> None:
+        """Embed one batch of emails with their attachment text and clear their stale flags."""
+        email_ids = [email.id for email in emails]
+        attachment_text = defaultdict(list)
+        for email_id, extracted_text in self.db.execute(
+            select(models.Attachment.email_id, models.Attachment.extracted_text).where(
+                models.Attachment.email_id.in_(email_ids),
+                models.Attachment.extracted_text != None
+            ).order_by(models.Attachment.id)
+        ):
+            attachment_text[email_id].append(extracted_text)
+
+        texts = [
+            "\n".join([email.subject or "", email.body or ""] + attachment_text.get(email.id, []))
+            [:settings.embedding_text_chars]
+            for email in emails
+        ]
+        self.index.add(email_ids, self.backend.embed(texts))
+        self.db.execute(
+            update(models.Email).where(models.Email.id.in_(email_ids), models.Email.embedding_stale == True)
+            .values(embedding_stale=False)
+        )
+        self.db.commit()
+
+    def search(self, query: str, limit: int = 10, offset: int = 0) -> List[Dict[str, Any]]:
+        """Return the emails closest to the query by cosine similarity, best first."""
+        self.index.open(self.backend.name, self.backend.dimension)
+        hits = self.index.search(self.backend.embed([query])[0], limit + offset)
+        return [{"email_id": email_id, "score": round(score, 4)} for email_id, score in hits[offset:]]
@@ -0,0 +1,408 @@
+import io
+import os
+import re
+import time
+import zipfile
+import tempfile
+import logging
+from html.parser import HTMLParser
+from email import policy
+from email.parser import BytesParser
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+import olefile
+from PyPDF2 import PdfReader
+from docx import Document
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = b"PK\x03\x04"
+SNIFF_BYTES = 8192
+
+class ExtractionTimeout(Exception):
+    pass
+
+class ExtractionBudget:
+    """Page, character and wall-clock limits shared by one extraction.
+
+    Extractors call charge() as they produce text; it raises
+    ExtractionTimeout once the deadline passes and reports when the
+    page or character cap has been reached so they can stop early.
+    """
+
+    def __init__(self, timeout: float, max_pages: int, max_chars: int):
+        self.deadline = time.monotonic() + timeout
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self.pages = 0
+        self.chars = 0
+
+    def check(self) -> None:
+        if time.monotonic() > self.deadline:
+            raise ExtractionTimeout("Extraction timed out")
+
+    def charge(self, text: str, pages: int = 0) -> bool:
+        """Account for produced text; returns False once a cap is reached."""
+        self.check()
+        self.pages += pages
+        self.chars += len(text)
+        return self.pages < self.max_pages and self.chars < self.max_chars
+
+class Extractor:
+    """A registered extraction function.
+
+    Paged extractors are generators yielding one string per page (PDF
+    pages, slides) and are consumed lazily; the others return the whole
+    document as a single page.
+    """
+
+    def __init__(self, kind: str, version: str, extract: Callable[[str, ExtractionBudget], object],
+                 timeout: Optional[float] = None, max_bytes: Optional[int] = None, paged: bool = False):
+        self.kind = kind
+        self.version = version
+        self.extract_func = extract
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.paged = paged
+
+    @property
+    def tag(self) -> str:
+        """Kind and version, stored with extracted text so a version bump triggers re-extraction."""
+        return f"{self.kind}:{self.version}"
+
+    def extract(self, file_path: str, max_pages: Optional[int] = None,
+                max_chars: Optional[int] = None) -> str:
+        """Run the extractor within its size cap and time, page and character budget."""
+        return "\n".join(text for _, text in self.iter_pages(file_path, max_pages, max_chars))
+
+    def iter_pages(self, file_path: str, max_pages: Optional[int] = None,
+                   max_chars: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) pairs, stopping once the page or character budget is spent."""
+        max_bytes = self.max_bytes or settings.extraction_max_bytes
+        size = os.path.getsize(file_path)
+        if size > max_bytes:
+            raise ValueError(f"{self.kind} file of {size} bytes exceeds the {max_bytes} byte cap")
+        budget = ExtractionBudget(
+            timeout=self.timeout or settings.extraction_timeout,
+            max_pages=max_pages or settings.extraction_max_pages,
+            max_chars=max_chars or settings.extraction_max_chars
+        )
+
+        if not self.paged:
+            yield 1, self.extract_func(file_path, budget)[:budget.max_chars]
+            return
+
+        remaining = budget.max_chars
+        pages = self.extract_func(file_path, budget)
+        try:
+            for page_number, text in enumerate(pages, start=1):
+                yield page_number, text[:remaining]
+                remaining -= len(text)
+                if remaining <= 0 or page_number >= budget.max_pages:
+                    break
+        finally:
+            pages.close()
+
+EXTRACTORS: Dict[str, Extractor] = {}
+
+def register(kind: str, version: str, timeout: Optional[float] = None,
+             max_bytes: Optional[int] = None, paged: bool = False):
+    """Decorator adding an extraction function to the registry under a sniffed kind."""
+    def decorator(func: Callable[[str, ExtractionBudget], object]):
+        EXTRACTORS[kind] = Extractor(kind, version, func, timeout, max_bytes, paged)
+        return func
+    return decorator
+
+def get_extractor(kind: Optional[str]) -> Optional[Extractor]:
+    return EXTRACTORS.get(kind) if kind else None
+
+def current_tags() -> List[str]:
+    """The tag of every registered extractor at its current version."""
+    return [extractor.tag for extractor in EXTRACTORS.values()]
+
+def sniff(file_path: str, content_type: Optional[str] = None) -> Optional[str]:
+    """Identify a file's format from its leading bytes, not its name or declared type."""
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    if not head:
+        return None
+
+    if head.startswith(b"%PDF") or b"%PDF-" in head[:1024]:
+        return "pdf"
+    if head.startswith(ZIP_MAGIC):
+        return _sniff_zip(file_path)
+    if head.startswith(OLE_MAGIC):
+        return _sniff_ole(file_path)
+    if head.lstrip().startswith(b"{\\rtf"):
+        return "rtf"
+    if b"\x00" in head:
+        return None
+
+    text = head.decode("utf-8", errors="replace")
+    lowered = text.lstrip().lower()
+    if lowered.startswith(("<!doctype html", "<html")) or ("<html" in lowered[:1024] and "</" in lowered):
+        return "html"
+    if _looks_like_rfc822(text) or (content_type or "").lower() == "message/rfc822":
+        return "eml"
+    if text.count("\ufffd") <= len(text) // 100:
+        return "text"
+    return None
+
+def _sniff_zip(file_path: str) -> Optional[str]:
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            names = set(archive.namelist())
+    except zipfile.BadZipFile:
+        return None
+    if "word/document.xml" in names:
+        return "docx"
+    if "xl/workbook.xml" in names:
+        return "xlsx"
+    if "ppt/presentation.xml" in names:
+        return "pptx"
+    return None
+
+def _sniff_ole(file_path: str) -> Optional[str]:
+    try:
+        with olefile.OleFileIO(file_path) as ole:
+            # Outlook messages keep their properties in __substg1.0_ streams
+            if any(entry[0].startswith("__substg1.0_") for entry in ole.listdir()):
+                return "msg"
+    except Exception:
+        return None
+    return None
+
+HEADER_LINE = re.compile(r"^[A-Za-z][A-Za-z0-9-]*:", re.MULTILINE)
+
+def _looks_like_rfc822(text: str) -> bool:
+    header_block = text.split("\n\n", 1)[0].split("\r\n\r\n", 1)[0]
+    names = {match.group(0)[:-1].lower() for match in HEADER_LINE.finditer(header_block)}
+    return "from" in names and ("subject" in names or "message-id" in names or "date" in names)
+
+@register("pdf", "2", paged=True)
+def iter_pdf_pages(file_path: str, budget: ExtractionBudget) -> Iterator[str]:
+    """Yield PDF page text one page at a time; pages past the budget are never parsed."""
+    with open(file_path, "rb") as file:
+        pdf = PdfReader(file)
+        for page in pdf.pages:
+            budget.check()
+            page_text = page.extract_text() or ""
+            yield page_text
+            if not budget.charge(page_text, pages=1):
+                return
+
+@register("docx", "1")
+def extract_docx(file_path: str, budget: ExtractionBudget) -> str:
+    text = []
+    for paragraph in Document(file_path).paragraphs:
+        text.append(paragraph.text)
+        if not budget.charge(paragraph.text):
+            break
+    return "\n".join(text)
+
+def _xml_text(data: bytes, tag: str, budget: ExtractionBudget) -> List[str]:
+    text = []
+    for _, element in ElementTree.iterparse(io.BytesIO(data)):
+        if element.tag.endswith(tag) and element.text:
+            text.append(element.text)
+            if not budget.charge(element.text):
+                break
+        element.clear()
+    return text
+
+def _numbered(names: List[str], prefix: str) -> List[str]:
+    pattern = re.compile(re.escape(prefix) + r"(\d+)\.xml$")
+    matches = [(int(m.group(1)), name) for name in names for m in [pattern.match(name)] if m]
+    return [name for _, name in sorted(matches)]
+
+@register("xlsx", "1")
+def extract_xlsx(file_path: str, budget: ExtractionBudget) -> str:
+    with zipfile.ZipFile(file_path) as archive:
+        names = archive.namelist()
+        text = []
+        if "xl/sharedStrings.xml" in names:
+            text.extend(_xml_text(archive.read("xl/sharedStrings.xml"), "}t", budget))
+        # Inline strings live in the sheets themselves; each sheet counts as a page
+        for name in _numbered(names, "xl/worksheets/sheet"):
+            if not budget.charge("", pages=1):
+                break
+            text.extend(_xml_text(archive.read(name), "}t", budget))
+    return "\n".join(text)
+
+@register("pptx", "2", paged=True)
+def iter_pptx_slides(file_path: str, budget: ExtractionBudget) -> Iterator[str]:
+    with zipfile.ZipFile(file_path) as archive:
+        for name in _numbered(archive.namelist(), "ppt/slides/slide"):
+            yield " ".join(_xml_text(archive.read(name), "}t", budget))
+            if not budget.charge("", pages=1):
+                return
+
+class _HTMLText(HTMLParser):
+    SKIP = {"script", "style", "head", "noscript"}
+    BREAKS = {"p", "br", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self, budget: ExtractionBudget):
+        super().__init__()
+        self.budget = budget
+        self.parts: List[str] = []
+        self.skipping = 0
+        self.full = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+        elif tag in self.BREAKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self.skipping:
+            self.skipping -= 1
+
+    def handle_data(self, data):
+        if self.skipping or self.full or not data.strip():
+            return
+        self.parts.append(data)
+        self.full = not self.budget.charge(data)
+
+def html_to_text(html: str, budget: ExtractionBudget) -> str:
+    parser = _HTMLText(budget)
+    parser.feed(html)
+    parser.close()
+    return re.sub(r"\n\s*\n+", "\n\n", "".join(parser.parts)).strip()
+
+def _read_text(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return f.read().decode("utf-8", errors="replace")
+
+@register("html", "1")
+def extract_html(file_path: str, budget: ExtractionBudget) -> str:
+    return html_to_text(_read_text(file_path), budget)
+
+RTF_TOKEN = re.compile(r"\\([a-z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-fA-F]{2})|\\([^a-z])|([{}])|[\r\n]+|([^\\{}\r\n]+)", re.IGNORECASE)
+RTF_SKIP_DESTINATIONS = {"fonttbl", "colortbl", "stylesheet", "info", "pict", "header", "footer", "object", "themedata", "datastore"}
+
+@register("rtf", "1")
+def extract_rtf(file_path: str, budget: ExtractionBudget) -> str:
+    """Strip RTF control words, keeping paragraph breaks and hex-escaped characters."""
+    text = []
+    stack = []
+    skip = False
+    skip_fallback = False
+    for match in RTF_TOKEN.finditer(_read_text(file_path)):
+        word, number, hex_char, symbol, brace, plain = match.groups()
+        if brace == "{":
+            stack.append(skip)
+        elif brace == "}":
+            skip = stack.pop() if stack else False
+        elif skip:
+            continue
+        elif word:
+            if word in RTF_SKIP_DESTINATIONS:
+                skip = True
+            elif word in ("par", "line"):
+                text.append("\n")
+            elif word == "tab":
+                text.append("\t")
+            elif word == "u" and number:
+                # \uN is followed by a one-character fallback for old readers
+                text.append(chr(int(number) % 65536))
+                skip_fallback = True
+                continue
+        elif symbol == "*":
+            skip = True
+        elif symbol in ("\\", "{", "}"):
+            text.append(symbol)
+        elif hex_char:
+            if not skip_fallback:
+                text.append(bytes.fromhex(hex_char).decode("cp1252", errors="replace"))
+        elif plain:
+            if skip_fallback:
+                plain = plain[1:]
+            text.append(plain)
+            if not budget.charge(plain):
+                break
+        skip_fallback = False
+    return "".join(text).strip()
+
+@register("text", "1", max_bytes=20 * 1024 * 1024)
+def extract_plain_text(file_path: str, budget: ExtractionBudget) -> str:
+    with open(file_path, "rb") as f:
+        return f.read(budget.max_chars * 4).decode("utf-8", errors="replace")
+
+def _extract_nested(payload: bytes, content_type: Optional[str], budget: ExtractionBudget) -> str:
+    """Extract text from an attachment embedded in a message via the registry."""
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        tmp.write(payload)
+    try:
+        extractor = get_extractor(sniff(tmp.name, content_type))
+        if not extractor:
+            return ""
+        budget.check()
+        if extractor.paged:
+            return "\n".join(extractor.extract_func(tmp.name, budget))
+        return extractor.extract_func(tmp.name, budget)
+    except ExtractionTimeout:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not extract nested attachment: {str(e)}")
+        return ""
+    finally:
+        os.remove(tmp.name)
+
+@register("eml", "1")
+def extract_eml(file_path: str, budget: ExtractionBudget) -> str:
+    with open(file_path, "rb") as f:
+        message = BytesParser(policy=policy.default).parse(f)
+    text = [f"{name}: {message[name]}" for name in ("From", "To", "Date", "Subject") if message[name]]
+
+    body = message.get_body(preferencelist=("plain", "html"))
+    if body is not None:
+        content = body.get_content()
+        text.append(html_to_text(content, budget) if body.get_content_type() == "text/html" else content)
+        budget.charge(text[-1])
+
+    # Nested messages count as a page so a chain of forwards cannot recurse forever
+    budget.charge("", pages=1)
+    for part in message.iter_attachments():
+        if budget.chars >= budget.max_chars or budget.pages >= budget.max_pages:
+            break
+        payload = part.get_payload(decode=True)
+        if payload:
+            text.append(_extract_nested(payload, part.get_content_type(), budget))
+    return "\n".join(t for t in text if t)
+
+def _ole_string(ole: olefile.OleFileIO, stream_prefix: str) -> str:
+    # Properties are stored as UTF-16 (001F) or 8-bit (001E) streams
+    for suffix, encoding in (("001F", "utf-16-le"), ("001E", "cp1252")):
+        name = f"{stream_prefix}{suffix}"
+        if ole.exists(name):
+            return ole.openstream(name).read().decode(encoding, errors="replace").rstrip("\x00")
+    return ""
+
+@register("msg", "1")
+def extract_msg(file_path: str, budget: ExtractionBudget) -> str:
+    with olefile.OleFileIO(file_path) as ole:
+        fields = [
+            ("From", _ole_string(ole, "__substg1.0_0C1A")),
+            ("To", _ole_string(ole, "__substg1.0_0E04")),
+            ("Subject", _ole_string(ole, "__substg1.0_0037")),
+        ]
+        text = [f"{name}: {value}" for name, value in fields if value]
+        body = _ole_string(ole, "__substg1.0_1000")
+        if not body:
+            html = _ole_string(ole, "__substg1.0_1013")
+            body = html_to_text(html, budget) if html else ""
+        text.append(body)
+        budget.charge(body, pages=1)
+
+        attachment_dirs = sorted({entry[0] for entry in ole.listdir() if entry[0].startswith("__attach_version1.0_")})
+        for directory in attachment_dirs:
+            if budget.chars >= budget.max_chars or budget.pages >= budget.max_pages:
+                break
+            data_stream = f"{directory}/__substg1.0_37010102"
+            if ole.exists(data_stream):
+                mime = _ole_string(ole, f"{directory}/__substg1.0_370E")
+                text.append(_extract_nested(ole.openstream(data_stream).read(), mime or None, budget))
+    return "\n".join(t for t in text if t)
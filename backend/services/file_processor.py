@@ -1,28 +1,50 @@
 import os
 import pypff
-import mailbox
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Callable, Optional, Tuple
 import models
 from database import SessionLocal
 from config import settings
+from services.bulk_writer import EmailBulkWriter, StoredFingerprints
+from services.message_parser import MessageParser, parse_pst_range
+from services.mbox_index import find_message_offsets, parse_mbox_range
 import shutil
 
 class EmailFileProcessor:
     def __init__(self):
         self.db = SessionLocal()
-
-    def process_file(self, file_path: str) -> Dict[str, Any]:
+        self.parser = MessageParser()
+        self.writer: Optional[EmailBulkWriter] = None
+        self.progress_callback: Optional[Callable[[Dict[str, int]], None]] = None
+        self._last_progress = 0
+        self._existing_messages = 0
+
+    def process_file(self, file_path: str, mailbox_id: Optional[int] = None,
+                     progress_callback: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, Any]:
         """Process a PST or MBOX file."""
+        self.progress_callback = progress_callback
         try:
-            # Create mailbox record
-            mailbox_obj = models.Mailbox(
-                name=os.path.basename(file_path),
-                type='pst' if file_path.lower().endswith('.pst') else 'mbox',
-                last_processed=datetime.utcnow()
-            )
-            self.db.add(mailbox_obj)
-            self.db.commit()
+            if mailbox_id is not None:
+                mailbox_obj = self.db.query(models.Mailbox).filter(models.Mailbox.id == mailbox_id).first()
+                if not mailbox_obj:
+                    raise ValueError("Mailbox not found")
+            else:
+                # Create mailbox record
+                mailbox_obj = models.Mailbox(
+                    name=os.path.basename(file_path),
+                    type='pst' if file_path.lower().endswith('.pst') else 'mbox',
+                    last_processed=datetime.utcnow()
+                )
+                self.db.add(mailbox_obj)
+                self.db.commit()
+            # A re-import adds to what the mailbox already holds
+            self._existing_messages = self.db.query(models.Email).filter(
+                models.Email.mailbox_id == mailbox_obj.id
+            ).count()
+            # Only a re-import can meet stored messages; skip them before reading their attachments
+            self.parser.known = StoredFingerprints(mailbox_obj.id) if self._existing_messages else None
 
             if file_path.lower().endswith('.pst'):
                 stats = self.process_pst_file(file_path, mailbox_obj)
@@ -32,9 +54,7 @@ class EmailFileProcessor:
                 raise ValueError("Unsupported file type")
 
             # Update mailbox stats
-            mailbox_obj.total_messages = stats['total_messages']
-            mailbox_obj.processed_messages = stats['processed_messages']
-            self.db.commit()
+            self._report_progress(stats, mailbox_obj, force=True)
 
             return stats
         except Exception as e:
@@ -50,174 +70,147 @@ class EmailFileProcessor:
             pst.open(file_path)
             root = pst.get_root_folder()
             
-            stats = {
-                'total_messages': 0,
-                'processed_messages': 0,
-                'attachments': 0
-            }
+            stats = self._new_stats(self._count_pst_messages(root))
+            self.writer = EmailBulkWriter(self.db, mailbox_obj.id)
+            self._report_progress(stats, mailbox_obj, force=True)
             
-            self._process_pst_folder(root, stats, mailbox_obj)
+            if settings.parser_workers > 1:
+                self._process_pst_parallel(file_path, root, stats, mailbox_obj)
+            else:
+                self._process_pst_folder(root, stats, mailbox_obj)
+            self._flush_writer(stats)
             
             return stats
         except Exception as e:
             print(f"Error processing PST file: {e}")
             raise
 
+    def _count_pst_messages(self, folder: pypff.folder) -> int:
+        """Count messages in a PST folder tree without reading them."""
+        count = folder.get_number_of_messages()
+        for i in range(folder.get_number_of_sub_folders()):
+            count += self._count_pst_messages(folder.get_sub_folder(i))
+        return count
+
     def _process_pst_folder(self, folder: pypff.folder, stats: Dict[str, int], mailbox_obj: models.Mailbox) -> None:
         """Process a folder in a PST file."""
         for i in range(folder.get_number_of_sub_folders()):
             self._process_pst_folder(folder.get_sub_folder(i), stats, mailbox_obj)
 
         for i in range(folder.get_number_of_messages()):
-            message = folder.get_message(i)
-            stats['total_messages'] += 1
-            
             try:
-                self._process_email(
-                    subject=message.get_subject() or "",
-                    sender=message.get_sender_name() or "",
-                    received_date=message.get_delivery_time(),
-                    body=message.get_plain_text_body() or "",
-                    attachments=self._get_pst_attachments(message),
-                    mailbox_obj=mailbox_obj
-                )
-                stats['processed_messages'] += 1
+                record = self.parser.parse_pst_message(folder.get_message(i))
+                self.writer.add(record)
             except Exception as e:
+                stats['parse_failures'] += 1
                 print(f"Error processing message: {e}")
+            self._sync_stats(stats)
+            self._report_progress(stats, mailbox_obj)
+
+    def _plan_pst_tasks(self, folder: pypff.folder, folder_path: Tuple[int, ...] = ()) -> List[Tuple[Tuple[int, ...], int, int]]:
+        """Split a PST folder tree into (folder path, start, end) message ranges."""
+        tasks = []
+        for i in range(folder.get_number_of_sub_folders()):
+            tasks.extend(self._plan_pst_tasks(folder.get_sub_folder(i), folder_path + (i,)))
+
+        task_size = settings.parser_task_size
+        count = folder.get_number_of_messages()
+        for start in range(0, count, task_size):
+            tasks.append((folder_path, start, min(start + task_size, count)))
+        return tasks
+
+    def _process_pst_parallel(self, file_path: str, root: pypff.folder,
+                              stats: Dict[str, int], mailbox_obj: models.Mailbox) -> None:
+        """Parse PST message ranges across a process pool and write the results in batches."""
+        tasks = [(file_path,) + task + (self.parser.known,) for task in self._plan_pst_tasks(root)]
+        self._run_parse_tasks(parse_pst_range, tasks, stats, mailbox_obj)
+
+    def _run_parse_tasks(self, parse_func: Callable, tasks: List[Tuple], stats: Dict[str, int],
+                         mailbox_obj: models.Mailbox) -> None:
+        """Run parse_func over task arguments, in a process pool when parser_workers > 1."""
+        workers = settings.parser_workers
+        if workers <= 1:
+            for args in tasks:
+                self._write_parsed(parse_func(*args), stats, mailbox_obj)
+            return
+
+        # Spawned workers avoid inheriting the ingestion thread's locks and DB connections
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            pending = set()
+            while tasks or pending:
+                # Keep a bounded number of ranges in flight so parsed records do not pile up
+                while tasks and len(pending) < workers * 2:
+                    pending.add(executor.submit(parse_func, *tasks.pop(0)))
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._write_parsed(future.result(), stats, mailbox_obj)
+
+    def _write_parsed(self, result: Tuple[List[Dict[str, Any]], int], stats: Dict[str, int],
+                      mailbox_obj: models.Mailbox) -> None:
+        records, failures = result
+        stats['parse_failures'] += failures
+        for record in records:
+            self.writer.add(record)
+        self._sync_stats(stats)
+        self._report_progress(stats, mailbox_obj)
 
     def process_mbox_file(self, file_path: str, mailbox_obj: models.Mailbox) -> Dict[str, Any]:
         """Process an MBOX file."""
         try:
-            mbox = mailbox.mbox(file_path)
+            # One pass over the memory-mapped file finds every message boundary
+            offsets = find_message_offsets(file_path)
             
-            stats = {
-                'total_messages': len(mbox),
-                'processed_messages': 0,
-                'attachments': 0
-            }
+            stats = self._new_stats(len(offsets))
+            self.writer = EmailBulkWriter(self.db, mailbox_obj.id)
+            self._report_progress(stats, mailbox_obj, force=True)
             
-            for message in mbox:
-                try:
-                    self._process_email(
-                        subject=message['subject'] or "",
-                        sender=message['from'] or "",
-                        received_date=datetime.fromtimestamp(message.get_date()),
-                        body=self._get_mbox_body(message),
-                        attachments=self._get_mbox_attachments(message),
-                        mailbox_obj=mailbox_obj
-                    )
-                    stats['processed_messages'] += 1
-                except Exception as e:
-                    print(f"Error processing message: {e}")
+            task_size = settings.parser_task_size
+            tasks = [
+                (file_path, offsets[i:i + task_size], self.parser.known)
+                for i in range(0, len(offsets), task_size)
+            ]
+            self._run_parse_tasks(parse_mbox_range, tasks, stats, mailbox_obj)
+            self._flush_writer(stats)
             
             return stats
         except Exception as e:
             print(f"Error processing MBOX file: {e}")
             raise
 
-    def _process_email(self, subject: str, sender: str, received_date: datetime,
-                      body: str, attachments: List[Dict[str, Any]], 
-                      mailbox_obj: models.Mailbox) -> None:
-        """Process a single email."""
-        try:
-            # Create or get sender contact
-            contact = self.db.query(models.Contact).filter_by(email=sender).first()
-            if not contact:
-                # Try to extract organization from email domain
-                org = None
-                if '@' in sender:
-                    domain = sender.split('@')[1]
-                    org = self.db.query(models.Organization).filter_by(domain=domain).first()
-                    if not org:
-                        org = models.Organization(
-                            name=domain.split('.')[0].capitalize(),
-                            domain=domain
-                        )
-                        self.db.add(org)
-                        self.db.flush()
-
-                contact = models.Contact(
-                    email=sender,
-                    organization_id=org.id if org else None
-                )
-                self.db.add(contact)
-                self.db.flush()
-
-            # Create email record
-            email = models.Email(
-                subject=subject,
-                sender_id=contact.id,
-                received_date=received_date,
-                body=body,
-                importance='normal',
-                mailbox_id=mailbox_obj.id
-            )
-            self.db.add(email)
-            self.db.flush()
-
-            # Process attachments
-            for attachment_data in attachments:
-                attachment = models.Attachment(
-                    email_id=email.id,
-                    filename=attachment_data['filename'],
-                    storage_path=attachment_data['path'],
-                    processed=False
-                )
-                self.db.add(attachment)
-            
-            self.db.commit()
-        except Exception as e:
-            self.db.rollback()
-            raise e
-
-    def _get_pst_attachments(self, message: pypff.message) -> List[Dict[str, Any]]:
-        """Extract attachments from a PST message."""
-        attachments = []
-        for i in range(message.get_number_of_attachments()):
-            attachment = message.get_attachment(i)
-            filename = attachment.get_name() or f"attachment_{i}"
-            
-            # Save attachment to file
-            file_path = os.path.join(settings.attachment_storage_path, filename)
-            with open(file_path, 'wb') as f:
-                f.write(attachment.read_buffer())
-            
-            attachments.append({
-                'filename': filename,
-                'path': file_path
-            })
-        
-        return attachments
-
-    def _get_mbox_attachments(self, message: mailbox.Message) -> List[Dict[str, Any]]:
-        """Extract attachments from an MBOX message."""
-        attachments = []
-        if message.is_multipart():
-            for part in message.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                if part.get('Content-Disposition') is None:
-                    continue
-                
-                filename = part.get_filename()
-                if filename:
-                    # Save attachment to file
-                    file_path = os.path.join(settings.attachment_storage_path, filename)
-                    with open(file_path, 'wb') as f:
-                        f.write(part.get_payload(decode=True))
-                    
-                    attachments.append({
-                        'filename': filename,
-                        'path': file_path,
-                        'content_type': part.get_content_type()
-                    })
-        
-        return attachments
-
-    def _get_mbox_body(self, message: mailbox.Message) -> str:
-        """Extract the text body from an MBOX message."""
-        if message.is_multipart():
-            for part in message.walk():
-                if part.get_content_type() == "text/plain":
-                    return part.get_payload(decode=True).decode()
-        return message.get_payload(decode=True).decode() if message.get_payload() else ""
+    def _new_stats(self, total_messages: int) -> Dict[str, int]:
+        return {
+            'total_messages': total_messages,
+            'processed_messages': 0,
+            'skipped_messages': 0,
+            'failed_messages': 0,
+            'parse_failures': 0,
+            'attachments': 0
+        }
+
+    def _flush_writer(self, stats: Dict[str, int]) -> None:
+        self.writer.flush()
+        self._sync_stats(stats)
+
+    def _sync_stats(self, stats: Dict[str, int]) -> None:
+        """Copy committed counters from the bulk writer into stats."""
+        stats['processed_messages'] = self.writer.written
+        stats['skipped_messages'] = self.writer.skipped
+        stats['failed_messages'] = stats['parse_failures'] + self.writer.failed
+        stats['attachments'] = self.writer.attachments
+
+    def _report_progress(self, stats: Dict[str, int], mailbox_obj: models.Mailbox, force: bool = False) -> None:
+        """Persist message counters on the mailbox every progress_interval messages."""
+        seen = stats['processed_messages'] + stats['skipped_messages'] + stats['failed_messages']
+        if not force and seen - self._last_progress < settings.progress_interval:
+            return
+        self._last_progress = seen
+
+        mailbox_obj.processed_messages = self._existing_messages + stats['processed_messages']
+        mailbox_obj.total_messages = max(stats['total_messages'], mailbox_obj.processed_messages)
+        mailbox_obj.last_processed = datetime.utcnow()
+        self.db.commit()
+
+        if self.progress_callback:
+            self.progress_callback(stats)
@@ -0,0 +1,202 @@
+import threading
+from collections import OrderedDict
+from email.utils import parseaddr
+from typing import Dict, Any, List, Tuple, Optional
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+import models
+from config import settings
+
+# Keep IN (...) lists well under SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+def chunked(items: List[Any], size: int = LOOKUP_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def normalize_address(value: str) -> str:
+    """Reduce a From/To header value to a lowercase bare address."""
+    if not value:
+        return ""
+    _, address = parseaddr(value)
+    return (address or value).strip().lower()
+
+def address_domain(address: str) -> Optional[str]:
+    if '@' not in address:
+        return None
+    return address.rsplit('@', 1)[1] or None
+
+class LRUCache:
+    """Small thread-safe LRU map shared by all ingestion jobs in the process."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self.lock:
+            if key not in self.data:
+                return None
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def update(self, items: Dict[Any, Any]) -> None:
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            for key, value in items.items():
+                self.data[key] = value
+                self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+# Process-wide caches, bounded by settings.identity_cache_size entries each
+shared_contacts = LRUCache(settings.identity_cache_size)
+shared_organizations = LRUCache(settings.identity_cache_size)
+
+class IdentityCache:
+    """Per-ingestion address -> contact and domain -> organization lookup.
+
+    Misses fall through to the process-wide LRU, then to one batched SELECT,
+    and finally to a bulk INSERT. Rows created inside a transaction are kept
+    pending until commit() so a rollback never leaves dangling ids behind.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.contacts: Dict[str, Tuple[int, Optional[int]]] = {}
+        self.organizations: Dict[str, int] = {}
+        self.pending_contacts: Dict[str, Tuple[int, Optional[int]]] = {}
+        self.pending_organizations: Dict[str, int] = {}
+
+    def prewarm(self, limit: Optional[int] = None) -> None:
+        """Load existing contacts and organizations from the database."""
+        limit = settings.identity_cache_prewarm_limit if limit is None else limit
+        if limit <= 0:
+            return
+        rows = self.db.execute(
+            select(models.Organization.domain, models.Organization.id)
+            .order_by(models.Organization.id).limit(limit)
+        )
+        for domain, org_id in rows:
+            self.organizations.setdefault(domain, org_id)
+        rows = self.db.execute(
+            select(models.Contact.email, models.Contact.id, models.Contact.organization_id)
+            .order_by(models.Contact.id).limit(limit)
+        )
+        for email, contact_id, org_id in rows:
+            self.contacts.setdefault(email, (contact_id, org_id))
+
+    def resolve_contacts(self, senders: List[Tuple[str, Optional[str]]]) -> Dict[str, Tuple[int, Optional[int]]]:
+        """Map (address, display name) pairs to (contact_id, org_id), creating missing contacts."""
+        names: Dict[str, Optional[str]] = {}
+        for address, name in senders:
+            if address not in names or not names[address]:
+                names[address] = name
+
+        resolved: Dict[str, Tuple[int, Optional[int]]] = {}
+        missing = []
+        for address in names:
+            hit = self.contacts.get(address) or self.pending_contacts.get(address) or shared_contacts.get(address)
+            if hit:
+                resolved[address] = hit
+                self.contacts.setdefault(address, hit)
+            else:
+                missing.append(address)
+        if not missing:
+            return resolved
+
+        found = {}
+        for chunk in chunked(missing):
+            rows = self.db.execute(
+                select(models.Contact.email, models.Contact.id, models.Contact.organization_id)
+                .where(models.Contact.email.in_(chunk))
+            ).all()
+            for email, contact_id, org_id in rows:
+                found.setdefault(email, (contact_id, org_id))
+        resolved.update(found)
+        self.contacts.update(found)
+        shared_contacts.update(found)
+
+        missing = [address for address in missing if address not in found]
+        if not missing:
+            return resolved
+
+        org_ids = self.resolve_organizations(
+            [address_domain(address) for address in missing if address_domain(address)]
+        )
+        contact_rows = []
+        for address in missing:
+            domain = address_domain(address)
+            contact_rows.append({
+                'email': address,
+                'name': names[address] or None,
+                'organization_id': org_ids.get(domain) if domain else None
+            })
+        contact_ids = self.db.scalars(
+            insert(models.Contact).returning(models.Contact.id, sort_by_parameter_order=True),
+            contact_rows
+        ).all()
+        for contact_id, row in zip(contact_ids, contact_rows):
+            resolved[row['email']] = (contact_id, row['organization_id'])
+            self.pending_contacts[row['email']] = (contact_id, row['organization_id'])
+        return resolved
+
+    def resolve_organizations(self, domains: List[str]) -> Dict[str, int]:
+        """Map email domains to organization ids, creating missing organizations."""
+        resolved: Dict[str, int] = {}
+        missing = []
+        for domain in dict.fromkeys(domains):
+            hit = self.organizations.get(domain) or self.pending_organizations.get(domain) or shared_organizations.get(domain)
+            if hit:
+                resolved[domain] = hit
+                self.organizations.setdefault(domain, hit)
+            else:
+                missing.append(domain)
+        if not missing:
+            return resolved
+
+        found = {}
+        for chunk in chunked(missing):
+            rows = self.db.execute(
+                select(models.Organization.domain, models.Organization.id)
+                .where(models.Organization.domain.in_(chunk))
+            ).all()
+            for domain, org_id in rows:
+                found.setdefault(domain, org_id)
+        resolved.update(found)
+        self.organizations.update(found)
+        shared_organizations.update(found)
+
+        org_rows = [
+            {'name': domain.split('.')[0].capitalize(), 'domain': domain}
+            for domain in missing if domain not in found
+        ]
+        if org_rows:
+            org_ids = self.db.scalars(
+                insert(models.Organization).returning(models.Organization.id, sort_by_parameter_order=True),
+                org_rows
+            ).all()
+            for org_id, row in zip(org_ids, org_rows):
+                resolved[row['domain']] = org_id
+                self.pending_organizations[row['domain']] = org_id
+        return resolved
+
+    def commit(self) -> None:
+        """Promote rows created in the committed transaction into the caches."""
+        self.contacts.update(self.pending_contacts)
+        self.organizations.update(self.pending_organizations)
+        shared_contacts.update(self.pending_contacts)
+        shared_organizations.update(self.pending_organizations)
+        self.pending_contacts.clear()
+        self.pending_organizations.clear()
+
+    def rollback(self) -> None:
+        """Forget rows created in a transaction that was rolled back."""
+        self.pending_contacts.clear()
+        self.pending_organizations.clear()
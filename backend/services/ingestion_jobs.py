@@ -0,0 +1,194 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from sqlalchemy import select, update, delete
+import models
+from database import SessionLocal
+from config import settings
+from services.file_processor import EmailFileProcessor
+
+class IngestionJobManager:
+    """Runs PST/MBOX ingestion jobs on a thread pool.
+
+    Jobs are rows in ingestion_jobs and their message counts are the
+    mailbox's own total_messages/processed_messages, so progress survives
+    a restart. Jobs a previous process left queued or running are picked
+    up again by resume(); re-importing skips what was already written.
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or settings.ingestion_workers,
+            thread_name_prefix="ingestion"
+        )
+
+    def submit(self, file_path: str, filename: str, mailbox_id: Optional[int] = None) -> Dict[str, Any]:
+        """Queue an uploaded file for ingestion.
+
+        Without a mailbox_id a new mailbox is registered. With one, the file is
+        a re-import into that mailbox and only messages it lacks are written.
+        Raises KeyError for an unknown mailbox_id.
+        """
+        db = SessionLocal()
+        try:
+            if mailbox_id is not None:
+                if db.get(models.Mailbox, mailbox_id) is None:
+                    raise KeyError(mailbox_id)
+            else:
+                mailbox_obj = models.Mailbox(
+                    name=filename,
+                    type='pst' if filename.lower().endswith('.pst') else 'mbox',
+                    last_processed=datetime.utcnow()
+                )
+                db.add(mailbox_obj)
+                db.flush()
+                mailbox_id = mailbox_obj.id
+            job_id = uuid.uuid4().hex
+            db.add(models.IngestionJob(
+                id=job_id,
+                mailbox_id=mailbox_id,
+                file_path=file_path,
+                filename=filename,
+                status="queued",
+                created_at=datetime.utcnow()
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+        self.executor.submit(self._run, job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a progress snapshot for a job, or None if it is unknown."""
+        rows = self._query(models.IngestionJob.id == job_id)
+        return rows[0] if rows else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Return progress snapshots for all jobs, oldest first."""
+        return self._query()
+
+    def resume(self) -> int:
+        """Requeue jobs left queued or running by a previous process; returns how many were requeued.
+
+        A job whose uploaded file is gone is marked failed, and a mailbox it
+        created that never received a message is removed with it.
+        """
+        db = SessionLocal()
+        requeued = []
+        try:
+            jobs = db.scalars(
+                select(models.IngestionJob).where(models.IngestionJob.status.in_(("queued", "running")))
+                .order_by(models.IngestionJob.created_at)
+            ).all()
+            for job in jobs:
+                if os.path.exists(job.file_path):
+                    job.status = "queued"
+                    requeued.append(job.id)
+                    continue
+                job.status = "failed"
+                job.error = "Uploaded file was lost before ingestion finished"
+                job.finished_at = datetime.utcnow()
+                mailbox_id = job.mailbox_id
+                has_emails = db.scalar(
+                    select(models.Email.id).where(models.Email.mailbox_id == mailbox_id).limit(1)
+                ) is not None
+                other_jobs = db.scalar(
+                    select(models.IngestionJob.id).where(
+                        models.IngestionJob.mailbox_id == mailbox_id,
+                        models.IngestionJob.id != job.id,
+                        models.IngestionJob.status != "failed"
+                    ).limit(1)
+                ) is not None
+                if not has_emails and not other_jobs:
+                    db.execute(update(models.IngestionJob).where(
+                        models.IngestionJob.mailbox_id == mailbox_id
+                    ).values(mailbox_id=None))
+                    db.execute(delete(models.Mailbox).where(models.Mailbox.id == mailbox_id))
+            db.commit()
+        finally:
+            db.close()
+
+        for job_id in requeued:
+            self.executor.submit(self._run, job_id)
+        return len(requeued)
+
+    def shutdown(self) -> None:
+        # Jobs still queued stay queued in the database and are resumed on the next start
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _query(self, *conditions) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(models.IngestionJob, models.Mailbox.total_messages, models.Mailbox.processed_messages)
+                .outerjoin(models.Mailbox, models.Mailbox.id == models.IngestionJob.mailbox_id)
+                .where(*conditions)
+                .order_by(models.IngestionJob.created_at)
+            ).all()
+            return [self._snapshot(*row) for row in rows]
+        finally:
+            db.close()
+
+    def _snapshot(self, job: models.IngestionJob, total_messages: Optional[int],
+                  processed_messages: Optional[int]) -> Dict[str, Any]:
+        elapsed = 0.0
+        if job.started_at:
+            elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+
+        return {
+            "job_id": job.id,
+            "status": job.status,
+            "filename": job.filename,
+            "mailbox_id": job.mailbox_id,
+            "created_at": job.created_at.isoformat(),
+            # The mailbox's counters; a re-import's processed count includes what it already held
+            "total_messages": total_messages,
+            "processed_messages": processed_messages,
+            "messages_seen": job.messages_seen,
+            "skipped_messages": job.skipped_messages,
+            "attachments": job.attachments,
+            "elapsed_seconds": round(elapsed, 2),
+            "messages_per_second": round(job.messages_seen / elapsed, 2) if elapsed > 0 else 0.0,
+            "error": job.error
+        }
+
+    def _run(self, job_id: str) -> None:
+        db = SessionLocal()
+        try:
+            job = db.get(models.IngestionJob, job_id)
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            job.finished_at = None
+            db.commit()
+
+            def on_progress(stats: Dict[str, int]) -> None:
+                # The processor has just committed the mailbox counters; record this run's own
+                job.messages_seen = sum(
+                    stats.get(key, 0)
+                    for key in ('processed_messages', 'skipped_messages', 'failed_messages')
+                )
+                job.skipped_messages = stats.get('skipped_messages', 0)
+                job.attachments = stats.get('attachments', 0)
+                db.commit()
+
+            try:
+                EmailFileProcessor().process_file(
+                    job.file_path,
+                    mailbox_id=job.mailbox_id,
+                    progress_callback=on_progress
+                )
+                job.status = "completed"
+            except Exception as e:
+                print(f"Ingestion job {job_id} failed: {e}")
+                db.rollback()
+                job.status = "failed"
+                job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+        finally:
+            db.close()
@@ -1,7 +1,13 @@
-from typing import Dict, List, Optional
-import openai
+import json
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from pydantic import BaseModel
 from config import settings
+from services.llm_providers import LLMProvider, get_llm_provider
+from services.tokens import split_by_tokens, strip_quoted_reply, truncate_to_tokens
+
+THREAD_SYSTEM_PROMPT = "You are an expert at analyzing email threads and extracting key insights."
+ATTACHMENT_SYSTEM_PROMPT = "You are an expert at analyzing document content and extracting key information."
 
 class EmailAnalysis(BaseModel):
     summary: str
@@ -12,13 +18,22 @@ class EmailAnalysis(BaseModel):
     topics: List[str]
 
 class LLMAnalyzer:
-    def __init__(self):
-        openai.api_key = settings.openai_api_key
-        self.model = "gpt-4"
+    # Characters of attachment text sent to the model
+    attachment_char_limit = 4000
+    # Bump whenever a prompt changes so cached results are not reused
+    prompt_version = "1"
+    # Completion tokens budgeted per email in a batched request
+    batch_tokens_per_email = 300
+
+    def __init__(self, provider: Optional[LLMProvider] = None):
+        self.provider = provider or get_llm_provider()
+        self.model = self.provider.default_model
+        # Cheaper model for intermediate thread summaries
+        self.fast_model = settings.llm_fast_model or self.model
 
     async def analyze_email(self, subject: str, body: str, sender: str, recipients: List[str]) -> EmailAnalysis:
         """
-        Analyze an email using GPT-4 to extract insights.
+        Analyze an email using the configured model to extract insights.
         """
         prompt = f"""Analyze this email and provide structured insights:
         From: {sender}
@@ -36,18 +51,13 @@ class LLMAnalyzer:
         """
 
         try:
-            response = await openai.ChatCompletion.acreate(
-                model=self.model,
+            analysis = await self.provider.complete(
                 messages=[
                     {"role": "system", "content": "You are an expert email analyzer. Extract key information and insights from emails."},
                     {"role": "user", "content": prompt}
                 ],
-                temperature=0.3,
                 max_tokens=1000
             )
-
-            # Parse the response
-            analysis = response.choices[0].message.content
             
             # Extract structured information from the analysis
             # This is a simplified version - in production, you'd want more robust parsing
@@ -101,21 +111,139 @@ class LLMAnalyzer:
             print(f"Error analyzing email: {e}")
             raise
 
+    async def analyze_email_batch(self, emails: List[Dict]) -> List[Optional[EmailAnalysis]]:
+        """
+        Analyze several short emails in one request with a JSON result per email.
+        Returns results in input order; None where the model's output for an email was missing or invalid.
+        """
+        items = [
+            {
+                "index": index,
+                "from": email['sender'],
+                "to": email['recipients'],
+                "subject": email['subject'],
+                "body": email['body']
+            }
+            for index, email in enumerate(emails)
+        ]
+        prompt = f"""Analyze each of these {len(items)} emails independently:
+        {json.dumps(items, ensure_ascii=False)}
+
+        Respond with only a JSON object of the form
+        {{"results": [{{"index": <email index>, "summary": "...", "sentiment": "positive|negative|neutral",
+        "key_entities": [{{"type": "...", "name": "..."}}], "action_items": ["..."],
+        "urgency_level": "low|normal|high", "topics": ["..."]}}]}}
+        with exactly one result per email.
+        """
+
+        try:
+            content = await self.provider.complete(
+                messages=[
+                    {"role": "system", "content": "You are an expert email analyzer. Extract key information and insights from emails."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=min(4000, self.batch_tokens_per_email * len(items))
+            )
+        except Exception as e:
+            print(f"Error analyzing email batch: {e}")
+            raise
+
+        results: List[Optional[EmailAnalysis]] = [None] * len(items)
+        try:
+            parsed = json.loads(content[content.index('{'):content.rindex('}') + 1])
+        except ValueError as e:
+            print(f"Unparseable batch analysis: {e}")
+            return results
+        for entry in parsed.get("results", []):
+            try:
+                index = int(entry.pop("index"))
+                if 0 <= index < len(results):
+                    results[index] = EmailAnalysis(**entry)
+            except Exception as e:
+                print(f"Invalid batch analysis entry: {e}")
+        return results
+
     async def analyze_thread(self, emails: List[Dict]) -> Dict:
         """
         Analyze an email thread to provide a comprehensive summary and insights.
+        Quoted history is stripped from each reply. Threads over thread_chunk_tokens
+        are summarized in chunks concurrently and the summaries merged (map-reduce).
+        """
+        thread_prompt, chunks = await self._thread_prompt(emails)
+
+        try:
+            analysis = await self.provider.complete(
+                messages=[
+                    {"role": "system", "content": THREAD_SYSTEM_PROMPT},
+                    {"role": "user", "content": thread_prompt}
+                ],
+                max_tokens=1500
+            )
+
+        except Exception as e:
+            print(f"Error analyzing thread: {e}")
+            raise
+
+        return {"analysis": analysis, **self._thread_fields(emails, chunks)}
+
+    async def stream_thread_analysis(self, emails: List[Dict], fields: Optional[Dict] = None) -> AsyncIterator[str]:
         """
-        thread_prompt = "Analyze this email thread and provide insights:\n\n"
-        for email in emails:
-            thread_prompt += f"""
+        Like analyze_thread, but yield the analysis text as the model generates it.
+        fields, when given, receives the result's other keys (thread_length, chunks)
+        once the prompt is built, so the caller can assemble the same result.
+        """
+        thread_prompt, chunks = await self._thread_prompt(emails)
+        if fields is not None:
+            fields.update(self._thread_fields(emails, chunks))
+        async for delta in self._stream(THREAD_SYSTEM_PROMPT, thread_prompt, 1500):
+            yield delta
+
+    def _thread_fields(self, emails: List[Dict], chunks: int) -> Dict:
+        """Thread result keys besides the analysis text; chunks only when the thread was map-reduced."""
+        fields = {"thread_length": len(emails)}
+        if chunks > 1:
+            fields["chunks"] = chunks
+        return fields
+
+    async def _thread_prompt(self, emails: List[Dict]) -> Tuple[str, int]:
+        """Build the final thread prompt, running the map-reduce stage first if needed; returns it with the chunk count."""
+        entries = [
+            f"""
             From: {email['sender']}
             Time: {email['timestamp']}
             Subject: {email['subject']}
-            Body: {email['body']}
+            Body: {strip_quoted_reply(email['body'])}
             ---
             """
+            for email in emails
+        ]
+        chunks = split_by_tokens(entries, settings.thread_chunk_tokens, self.model)
+        if len(chunks) <= 1:
+            heading = "Analyze this email thread and provide insights:"
+            # The single chunk holds entries already truncated to the chunk budget
+            thread_text = "".join(chunks[0]) if chunks else ""
+        else:
+            # Map: summarize each chunk; reduce: merge summaries level by level until they fit one prompt
+            summaries = await self._summarize_chunks(chunks, "emails from an email thread")
+            while True:
+                groups = split_by_tokens(summaries, settings.thread_chunk_tokens, self.model)
+                if len(groups) == 1:
+                    summaries = groups[0]
+                    break
+                if len(groups) >= len(summaries):
+                    # No progress: every summary fills a chunk on its own, so give each an equal share of one prompt
+                    share = max(1, settings.thread_chunk_tokens // len(summaries))
+                    summaries = [truncate_to_tokens(summary, share, self.model) for summary in summaries]
+                    break
+                summaries = await self._summarize_chunks(groups, "partial summaries of one email thread")
+            heading = (f"These are consecutive partial summaries of an email thread of {len(emails)} emails. "
+                       "Analyze the whole thread and provide insights:")
+            thread_text = "\n---\n".join(summaries)
+
+        thread_prompt = f"""{heading}
+
+        {thread_text}
 
-        thread_prompt += """
         Provide:
         1. Thread summary
         2. Key discussion points
@@ -123,34 +251,70 @@ class LLMAnalyzer:
         4. Action items
         5. Participants and their roles
         """
+        return thread_prompt, len(chunks)
 
+    async def _summarize_chunks(self, chunks: List[List[str]], description: str) -> List[str]:
+        """Summarize each chunk concurrently, at most thread_map_concurrency requests at a time."""
+        semaphore = asyncio.Semaphore(settings.thread_map_concurrency)
+
+        async def summarize(index: int, chunk: List[str]) -> str:
+            prompt = f"""Summarize part {index + 1} of {len(chunks)} of {description}:
+
+            {"".join(chunk)}
+
+            Keep decisions, open questions, action items with owners, dates and
+            who participated in what role. Be concise.
+            """
+            async with semaphore:
+                summary = await self.provider.complete(
+                    messages=[
+                        {"role": "system", "content": THREAD_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=settings.thread_summary_tokens,
+                    model=self.fast_model
+                )
+            return summary
+
+        try:
+            return list(await asyncio.gather(*[summarize(i, chunk) for i, chunk in enumerate(chunks)]))
+        except Exception as e:
+            print(f"Error summarizing thread: {e}")
+            raise
+
+    async def analyze_attachment_content(self, content: str, filename: str) -> Dict:
+        """
+        Analyze the content of an email attachment.
+        """
         try:
-            response = await openai.ChatCompletion.acreate(
-                model=self.model,
+            analysis = await self.provider.complete(
                 messages=[
-                    {"role": "system", "content": "You are an expert at analyzing email threads and extracting key insights."},
-                    {"role": "user", "content": thread_prompt}
+                    {"role": "system", "content": ATTACHMENT_SYSTEM_PROMPT},
+                    {"role": "user", "content": self._attachment_prompt(content, filename)}
                 ],
-                temperature=0.3,
-                max_tokens=1500
+                max_tokens=1000
             )
 
             return {
-                "analysis": response.choices[0].message.content,
-                "thread_length": len(emails)
+                "analysis": analysis,
+                "filename": filename
             }
 
         except Exception as e:
-            print(f"Error analyzing thread: {e}")
+            print(f"Error analyzing attachment: {e}")
             raise
 
-    async def analyze_attachment_content(self, content: str, filename: str) -> Dict:
+    async def stream_attachment_analysis(self, content: str, filename: str) -> AsyncIterator[str]:
         """
-        Analyze the content of an email attachment.
+        Like analyze_attachment_content, but yield the analysis text as the model generates it.
         """
-        prompt = f"""Analyze this document content from file '{filename}':
+        async for delta in self._stream(ATTACHMENT_SYSTEM_PROMPT, self._attachment_prompt(content, filename), 1000):
+            yield delta
 
-        {content[:4000]}  # Limit content length for token constraints
+    def _attachment_prompt(self, content: str, filename: str) -> str:
+        return f"""Analyze this document content from file '{filename}':
+
+        {content[:self.attachment_char_limit]}  # Limit content length for token constraints
 
         Provide:
         1. Document summary
@@ -160,22 +324,18 @@ class LLMAnalyzer:
         5. Important dates or deadlines mentioned
         """
 
+    async def _stream(self, system: str, prompt: str, max_tokens: int) -> AsyncIterator[str]:
+        """Yield completion text deltas as they arrive."""
         try:
-            response = await openai.ChatCompletion.acreate(
-                model=self.model,
+            async for delta in self.provider.stream(
                 messages=[
-                    {"role": "system", "content": "You are an expert at analyzing document content and extracting key information."},
+                    {"role": "system", "content": system},
                     {"role": "user", "content": prompt}
                 ],
-                temperature=0.3,
-                max_tokens=1000
-            )
-
-            return {
-                "analysis": response.choices[0].message.content,
-                "filename": filename
-            }
+                max_tokens=max_tokens
+            ):
+                yield delta
 
         except Exception as e:
-            print(f"Error analyzing attachment: {e}")
+            print(f"Error streaming analysis: {e}")
             raise
@@ -0,0 +1,129 @@
+import re
+import json
+import hashlib
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+from pydantic import BaseModel
+from sqlalchemy import select, delete, insert
+from sqlalchemy.orm import Session
+import models
+from config import settings
+from services.identity_cache import chunked
+
+WHITESPACE = re.compile(r'\s+')
+
+def normalize_input(value: Any) -> Any:
+    """Collapse whitespace in every string so formatting-only differences share a cache entry."""
+    if isinstance(value, str):
+        return WHITESPACE.sub(' ', value).strip()
+    if isinstance(value, dict):
+        return {key: normalize_input(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def input_hash(payload: Any) -> str:
+    normalized = json.dumps(normalize_input(payload), sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class LLMResultCache:
+    """Persisted LLM analyses keyed by model, prompt version and a hash of the normalized input.
+
+    Editing an email changes its input hash, so stale analyses are never
+    served; entries also expire after llm_cache_ttl seconds.
+    """
+
+    def __init__(self, db: Session, model: str, prompt_version: str, ttl: Optional[int] = None):
+        self.db = db
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl = settings.llm_cache_ttl if ttl is None else ttl
+
+    def get(self, kind: str, payload: Any) -> Optional[Any]:
+        """Return the cached result for this input, or None."""
+        row = self.db.execute(
+            select(models.LLMResult.result, models.LLMResult.expires_at).where(
+                models.LLMResult.input_hash == input_hash(payload),
+                models.LLMResult.kind == kind,
+                models.LLMResult.model == self.model,
+                models.LLMResult.prompt_version == self.prompt_version
+            ).order_by(models.LLMResult.created_at.desc()).limit(1)
+        ).first()
+        if not row or (row.expires_at and row.expires_at <= datetime.utcnow()):
+            return None
+        return json.loads(row.result)
+
+    def put(self, kind: str, subject: str, payload: Any, result: Any) -> None:
+        """Store a result, replacing earlier results for the same subject."""
+        if isinstance(result, BaseModel):
+            result = result.model_dump()
+        digest = input_hash(payload)
+        now = datetime.utcnow()
+        try:
+            self.db.execute(delete(models.LLMResult).where(
+                models.LLMResult.subject == subject,
+                models.LLMResult.kind == kind,
+                models.LLMResult.model == self.model
+            ))
+            self.db.add(models.LLMResult(
+                kind=kind,
+                subject=subject,
+                model=self.model,
+                prompt_version=self.prompt_version,
+                input_hash=digest,
+                result=json.dumps(result, default=str),
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl) if self.ttl else None
+            ))
+            self.db.commit()
+        except Exception as e:
+            print(f"Error caching {kind} analysis for {subject}: {e}")
+            self.db.rollback()
+
+    def put_many(self, kind: str, items: List[Tuple[str, Any, Any]]) -> None:
+        """Stage (subject, payload, result) triples in the current transaction; callers commit."""
+        if not items:
+            return
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl) if self.ttl else None
+        for chunk in chunked([subject for subject, _, _ in items]):
+            self.db.execute(delete(models.LLMResult).where(
+                models.LLMResult.subject.in_(chunk),
+                models.LLMResult.kind == kind,
+                models.LLMResult.model == self.model
+            ))
+        self.db.execute(insert(models.LLMResult), [
+            {
+                'kind': kind,
+                'subject': subject,
+                'model': self.model,
+                'prompt_version': self.prompt_version,
+                'input_hash': input_hash(payload),
+                'result': json.dumps(result.model_dump() if isinstance(result, BaseModel) else result, default=str),
+                'created_at': now,
+                'expires_at': expires_at
+            }
+            for subject, payload, result in items
+        ])
+
+    async def get_or_analyze(self, kind: str, subject: str, payload: Any,
+                             analyze: Callable[[], Awaitable[Any]], refresh: bool = False) -> Any:
+        """Return the cached analysis of payload, calling analyze() and caching its result on a miss."""
+        if not refresh:
+            cached = self.get(kind, payload)
+            if cached is not None:
+                return cached
+        result = await analyze()
+        self.put(kind, subject, payload, result)
+        return result
+
+    def purge_expired(self) -> int:
+        """Delete every expired result, whatever its model; returns the number removed."""
+        result = self.db.execute(delete(models.LLMResult).where(
+            models.LLMResult.expires_at != None,
+            models.LLMResult.expires_at <= datetime.utcnow()
+        ))
+        self.db.commit()
+        return result.rowcount
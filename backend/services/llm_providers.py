@@ -0,0 +1,137 @@
+import re
+import json
+import asyncio
+import hashlib
+from typing import AsyncIterator, Dict, List, Optional
+import httpx
+import openai
+from config import settings
+
+class LLMProvider:
+    """A chat completion backend. Subclasses implement complete() and stream()."""
+    name = "base"
+
+    def __init__(self, default_model: str):
+        self.default_model = default_model
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int,
+                       temperature: float = 0.3, model: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], max_tokens: int,
+               temperature: float = 0.3, model: Optional[str] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions over one pooled, keep-alive async HTTP client.
+
+    Also serves any OpenAI-compatible server (llama.cpp, vLLM, Ollama) when
+    given its base_url.
+    """
+    name = "openai"
+
+    def __init__(self, default_model: str, api_key: str, base_url: Optional[str] = None):
+        super().__init__(default_model)
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.llm_max_connections,
+                max_keepalive_connections=settings.llm_max_connections
+            ),
+            timeout=httpx.Timeout(settings.llm_timeout, connect=10.0)
+        )
+        # Retries on 429 are left to the callers, which know their rate limits
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self.http_client,
+            max_retries=0
+        )
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int,
+                       temperature: float = 0.3, model: Optional[str] = None) -> str:
+        response = await self.client.chat.completions.create(
+            model=model or self.default_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content or ""
+
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int,
+                     temperature: float = 0.3, model: Optional[str] = None) -> AsyncIterator[str]:
+        response = await self.client.chat.completions.create(
+            model=model or self.default_model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def close(self) -> None:
+        await self.http_client.aclose()
+
+class StubProvider(LLMProvider):
+    """Deterministic offline provider for tests and load tests.
+
+    Replies depend only on the prompt, arrive after llm_stub_latency seconds
+    and are shaped like real answers: JSON with one result per "index" for
+    batched prompts, "Summary:/Sentiment:/..." lines otherwise.
+    """
+    name = "stub"
+    INDEX = re.compile(r'"index":\s*(\d+)')
+
+    def __init__(self, default_model: str = "stub", latency: Optional[float] = None):
+        super().__init__(default_model)
+        self.latency = settings.llm_stub_latency if latency is None else latency
+
+    def _reply(self, messages: List[Dict[str, str]]) -> str:
+        prompt = messages[-1]["content"]
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        sentiment = ("positive", "neutral", "negative")[int(digest, 16) % 3]
+        indexes = self.INDEX.findall(prompt)
+        if indexes:
+            return json.dumps({"results": [
+                {
+                    "index": int(index),
+                    "summary": f"Stub summary {digest}-{index}",
+                    "sentiment": sentiment,
+                    "key_entities": [],
+                    "action_items": [],
+                    "urgency_level": "normal",
+                    "topics": ["stub"]
+                }
+                for index in indexes
+            ]})
+        return (f"Summary: Stub summary {digest}\n"
+                f"Sentiment: {sentiment}\n"
+                "Urgency: normal\n"
+                "Topics:\n- stub\n")
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int,
+                       temperature: float = 0.3, model: Optional[str] = None) -> str:
+        await asyncio.sleep(self.latency)
+        return self._reply(messages)
+
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int,
+                     temperature: float = 0.3, model: Optional[str] = None) -> AsyncIterator[str]:
+        words = self._reply(messages).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            yield word if i == len(words) - 1 else word + " "
+
+def get_llm_provider(name: Optional[str] = None) -> LLMProvider:
+    """Build the provider selected by LLM_PROVIDER: 'openai', 'local' or 'stub'."""
+    name = name or settings.llm_provider
+    if name == "openai":
+        return OpenAIProvider(settings.openai_model, settings.openai_api_key)
+    if name == "local":
+        return OpenAIProvider(settings.llm_local_model, settings.llm_local_api_key, base_url=settings.llm_local_base_url)
+    if name == "stub":
+        return StubProvider()
+    raise ValueError(f"Unknown LLM provider: {name}")
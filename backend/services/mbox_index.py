@@ -0,0 +1,62 @@
+import os
+import re
+import mmap
+from datetime import datetime
+from email import policy
+from email.parser import BytesParser
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from services.message_parser import MessageParser
+
+# An mbox message starts with a "From " line at the beginning of the file or of a line
+FROM_LINE = re.compile(rb'^From ', re.MULTILINE)
+
+def find_message_offsets(file_path: str) -> List[Tuple[int, int]]:
+    """Return the (start, end) byte range of every message in an mbox file.
+
+    The file is memory-mapped and scanned once for "From " separators, so
+    the message count is known without parsing any message.
+    """
+    if os.path.getsize(file_path) == 0:
+        return []
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            starts = [match.start() for match in FROM_LINE.finditer(mm)]
+            size = mm.size()
+    return list(zip(starts, starts[1:] + [size]))
+
+def parse_from_line_date(from_line: bytes) -> Optional[datetime]:
+    """Parse the asctime date at the end of an mbox "From " line."""
+    parts = from_line.decode('ascii', errors='replace').split()
+    if len(parts) < 7:
+        return None
+    try:
+        return datetime.strptime(" ".join(parts[-5:]), "%a %b %d %H:%M:%S %Y")
+    except ValueError:
+        return None
+
+def parse_mbox_range(file_path: str, ranges: List[Tuple[int, int]],
+                     known: Optional[Callable[[str], bool]] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """Parse the messages at the given byte ranges of an mbox file.
+
+    Runs inline or inside a pool worker; returns the parsed records and
+    the number of messages that failed to parse.
+    """
+    parser = MessageParser(known)
+    bytes_parser = BytesParser(policy=policy.compat32)
+    records = []
+    failures = 0
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start, end in ranges:
+                try:
+                    line_end = mm.find(b'\n', start, end)
+                    if line_end == -1:
+                        line_end = end
+                    message = bytes_parser.parsebytes(mm[line_end + 1:end])
+                    records.append(parser.parse_mbox_message(
+                        message, fallback_date=parse_from_line_date(mm[start:line_end])
+                    ))
+                except Exception as e:
+                    failures += 1
+                    print(f"Error processing message: {e}")
+    return records, failures
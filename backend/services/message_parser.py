@@ -0,0 +1,350 @@
+import re
+import pypff
+import mailbox
+import binascii
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple, Iterator, Iterable, Callable
+from email.message import Message
+from email.parser import HeaderParser
+from email.utils import parsedate_to_datetime, parseaddr, getaddresses
+from config import settings
+from services.identity_cache import normalize_address
+from services.attachment_store import AttachmentStore
+from services.triage import TRIAGE_HEADERS
+
+MESSAGE_ID = re.compile(r'<([^<>\s]+)>')
+
+# MAPI properties holding an attachment's file name and MIME type
+PR_ATTACH_LONG_FILENAME = 0x3707
+PR_ATTACH_FILENAME = 0x3704
+PR_ATTACH_MIME_TAG = 0x370E
+
+class AttachmentTooLarge(Exception):
+    """Raised mid-stream when an attachment exceeds max_attachment_size under the skip policy."""
+    pass
+
+def normalize_message_id(value: Optional[str]) -> Optional[str]:
+    """Strip whitespace and angle brackets from a Message-ID header."""
+    if not value:
+        return None
+    value = str(value).strip().strip('<>').strip()
+    return value.lower() or None
+
+def parse_message_ids(value: Optional[str]) -> List[str]:
+    """Normalized Message-IDs from an In-Reply-To or References header, in order."""
+    if not value:
+        return []
+    ids = []
+    for match in MESSAGE_ID.findall(str(value)):
+        message_id = normalize_message_id(match)
+        if message_id and message_id not in ids:
+            ids.append(message_id)
+    return ids
+
+def message_fingerprint(message_id: Optional[str], sender: str, received_date: Optional[datetime],
+                        subject: str, body: str) -> str:
+    """Stable per-message key: the Message-ID when present, else a hash of the content."""
+    if message_id:
+        key = f"mid:{message_id}"
+    else:
+        date = received_date.isoformat() if received_date else ""
+        key = f"content:{sender}\x00{date}\x00{subject}\x00{body}"
+    return hashlib.sha256(key.encode('utf-8', errors='replace')).hexdigest()
+
+class MessageParser:
+    """Turns PST and MBOX messages into plain records for the bulk writer.
+
+    The parser holds no database state so it can run inside pool workers.
+    known, when given, reports whether a fingerprint is already stored;
+    such messages come back marked 'known' before their attachments are
+    read or stored.
+    """
+
+    def __init__(self, known: Optional[Callable[[str], bool]] = None):
+        self.known = known
+        self.store = AttachmentStore()
+        self.chunk_size = settings.attachment_chunk_size
+        self.max_size = settings.max_attachment_size
+        self.size_policy = settings.attachment_size_policy
+
+    def parse_pst_message(self, message: pypff.message) -> Dict[str, Any]:
+        """Turn a PST message into a record for the bulk writer."""
+        headers = self._parse_pst_headers(message)
+        sender_name = message.get_sender_name() or ""
+        record = {
+            'message_id': normalize_message_id(headers['message-id']),
+            'in_reply_to': next(iter(parse_message_ids(headers['in-reply-to'])), None),
+            'references': parse_message_ids(headers['references']),
+            'subject': message.get_subject() or "",
+            'sender': normalize_address(headers['from'] or sender_name),
+            'sender_name': sender_name or parseaddr(headers['from'] or "")[0],
+            'received_date': message.get_delivery_time(),
+            'body': self._decode_text(message.get_plain_text_body()),
+        }
+        record['fingerprint'] = self._fingerprint(record)
+        if self._is_known(record):
+            return record
+        record['triage_headers'] = self._triage_headers(headers)
+        # pypff does not expose the recipient table, so PST recipients come from the transport headers
+        record['recipients'] = self._header_recipients(headers)
+        record['attachments'] = self._get_pst_attachments(message)
+        return record
+
+    def parse_mbox_message(self, message: Message, fallback_date: Optional[datetime] = None) -> Dict[str, Any]:
+        """Turn an MBOX message into a record for the bulk writer."""
+        sender_name, _ = parseaddr(message['from'] or "")
+        record = {
+            'message_id': normalize_message_id(message['message-id']),
+            'in_reply_to': next(iter(parse_message_ids(message['in-reply-to'])), None),
+            'references': parse_message_ids(message['references']),
+            'subject': message['subject'] or "",
+            'sender': normalize_address(message['from'] or ""),
+            'sender_name': sender_name,
+            'received_date': self._parse_date(message['date']) or fallback_date,
+            'body': self._get_mbox_body(message),
+        }
+        record['fingerprint'] = self._fingerprint(record)
+        if self._is_known(record):
+            return record
+        record['triage_headers'] = self._triage_headers(message)
+        record['recipients'] = self._header_recipients(message)
+        record['attachments'] = self._get_mbox_attachments(message)
+        return record
+
+    def _fingerprint(self, record: Dict[str, Any]) -> str:
+        return message_fingerprint(
+            record['message_id'], record['sender'], record['received_date'],
+            record['subject'], record['body']
+        )
+
+    def _is_known(self, record: Dict[str, Any]) -> bool:
+        """Mark a record whose message is already stored, so the writer skips it."""
+        record['known'] = bool(self.known and self.known(record['fingerprint']))
+        return record['known']
+
+    def _triage_headers(self, headers: Message) -> Dict[str, str]:
+        """The bulk-mail headers the triage stage scores, as plain strings."""
+        return {name: str(headers[name]) for name in TRIAGE_HEADERS if headers[name]}
+
+    def _header_recipients(self, headers: Message) -> List[Tuple[str, str, str]]:
+        """(address, display name, 'to'|'cc'|'bcc') for each To/Cc/Bcc address, first occurrence only."""
+        recipients = []
+        seen = set()
+        for recipient_type in ('to', 'cc', 'bcc'):
+            values = [str(value) for value in headers.get_all(recipient_type, [])]
+            for name, address in getaddresses(values):
+                address = address.strip().lower()
+                if '@' in address and address not in seen:
+                    seen.add(address)
+                    recipients.append((address, name, recipient_type))
+        return recipients
+
+    def _parse_pst_headers(self, message: pypff.message) -> Message:
+        """Parse the RFC 822 transport headers stored on a PST message."""
+        return HeaderParser().parsestr(self._decode_text(message.get_transport_headers()))
+
+    def _parse_date(self, value: Optional[str]) -> Optional[datetime]:
+        """Parse an RFC 2822 Date header, returning None when it is missing or malformed."""
+        if not value:
+            return None
+        try:
+            return parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _decode_text(self, value: Any) -> str:
+        if not value:
+            return ""
+        if isinstance(value, bytes):
+            return value.decode('utf-8', errors='replace')
+        return value
+
+    def _get_pst_attachments(self, message: pypff.message) -> List[Dict[str, Any]]:
+        """Extract attachments from a PST message."""
+        attachments = []
+        for i in range(message.get_number_of_attachments()):
+            attachment = message.get_attachment(i)
+            properties = self._pst_attachment_properties(attachment)
+            filename = (properties.get(PR_ATTACH_LONG_FILENAME)
+                        or properties.get(PR_ATTACH_FILENAME)
+                        or f"attachment_{i}")
+
+            size = attachment.get_size()
+            attachments.append(self._store_attachment(
+                filename,
+                properties.get(PR_ATTACH_MIME_TAG),
+                lambda: self._read_pst_attachment(attachment, size),
+                size
+            ))
+
+        return attachments
+
+    def _read_pst_attachment(self, attachment: pypff.attachment, size: int) -> Iterator[bytes]:
+        """Yield a PST attachment's data in bounded chunks."""
+        attachment.seek_offset(0)
+        remaining = size
+        while remaining > 0:
+            chunk = attachment.read_buffer(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def _pst_attachment_properties(self, attachment: pypff.attachment) -> Dict[int, str]:
+        """Read the string MAPI properties we care about from a PST attachment."""
+        wanted = (PR_ATTACH_LONG_FILENAME, PR_ATTACH_FILENAME, PR_ATTACH_MIME_TAG)
+        properties = {}
+        for record_set in attachment.record_sets:
+            for entry in record_set.entries:
+                if entry.entry_type in wanted and entry.entry_type not in properties:
+                    try:
+                        properties[entry.entry_type] = entry.get_data_as_string()
+                    except Exception:
+                        continue
+        return properties
+
+    def _get_mbox_attachments(self, message: mailbox.Message) -> List[Dict[str, Any]]:
+        """Extract attachments from an MBOX message."""
+        attachments = []
+        if message.is_multipart():
+            for part in message.walk():
+                if part.get_content_maintype() == 'multipart':
+                    continue
+                if part.get('Content-Disposition') is None:
+                    continue
+
+                filename = part.get_filename()
+                if filename:
+                    attachments.append(self._store_attachment(
+                        filename,
+                        part.get_content_type(),
+                        lambda: self._decode_mime_part(part)
+                    ))
+
+        return attachments
+
+    def _decode_mime_part(self, part: Message) -> Iterator[bytes]:
+        """Yield the decoded payload of a MIME part chunk by chunk."""
+        # get_payload() re-decodes 8bit payloads lossily; like the stdlib's own
+        # decoder, read the stored string, whose raw bytes are kept as surrogates
+        payload = part._payload
+        if not isinstance(payload, str):
+            return
+        encoding = str(part.get('content-transfer-encoding', '')).strip().lower()
+
+        if encoding == 'base64':
+            # Decode whole 4-character groups; carry the remainder to the next window
+            pending = ''
+            for window in self._line_windows(payload, self.chunk_size * 4 // 3):
+                pending += ''.join(window.split())
+                usable = len(pending) - len(pending) % 4
+                if usable:
+                    yield binascii.a2b_base64(pending[:usable])
+                    pending = pending[usable:]
+            if pending:
+                pending += '=' * (-len(pending) % 4)
+                yield binascii.a2b_base64(pending)
+        elif encoding == 'quoted-printable':
+            # Windows end on a line break, so no =XX escape or soft break is split
+            for window in self._line_windows(payload, self.chunk_size):
+                yield binascii.a2b_qp(window.encode('ascii', 'surrogateescape'))
+        elif encoding in ('x-uuencode', 'uuencode', 'uue', 'x-uue'):
+            yield part.get_payload(decode=True) or b''
+        else:
+            for start in range(0, len(payload), self.chunk_size):
+                yield payload[start:start + self.chunk_size].encode('ascii', 'surrogateescape')
+
+    def _line_windows(self, text: str, size: int) -> Iterator[str]:
+        """Slice text into windows of about size characters, each ending on a line break."""
+        start = 0
+        while start < len(text):
+            end = text.find('\n', start + size)
+            end = len(text) if end < 0 else end + 1
+            yield text[start:end]
+            start = end
+
+    def _store_attachment(self, filename: str, content_type: Optional[str], open_chunks,
+                          declared_size: Optional[int] = None) -> Dict[str, Any]:
+        """Stream an attachment into the store, applying the max_attachment_size policy.
+
+        Policies: "skip" records the attachment without storing its data,
+        "truncate" keeps the first max_attachment_size bytes, "keep" stores
+        everything.
+        """
+        record = {
+            'filename': filename,
+            'path': None,
+            'sha256': None,
+            'size': declared_size,
+            'content_type': content_type,
+            'truncated': False
+        }
+        if self.size_policy == 'skip' and declared_size is not None and declared_size > self.max_size:
+            return record
+
+        try:
+            stored = self.store.put_stream(self._limit(open_chunks(), record))
+        except AttachmentTooLarge:
+            return record
+
+        record.update(path=stored['path'], sha256=stored['sha256'])
+        if not record['truncated']:
+            record['size'] = stored['size']
+        return record
+
+    def _limit(self, chunks: Iterable[bytes], record: Dict[str, Any]) -> Iterator[bytes]:
+        if self.size_policy == 'keep':
+            yield from chunks
+            return
+
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            if total <= self.max_size:
+                yield chunk
+                continue
+            if self.size_policy == 'skip':
+                raise AttachmentTooLarge(record['filename'])
+            record['truncated'] = True
+            yield chunk[:len(chunk) - (total - self.max_size)]
+            return
+
+    def _get_mbox_body(self, message: mailbox.Message) -> str:
+        """Extract the text body from an MBOX message."""
+        if message.is_multipart():
+            for part in message.walk():
+                if part.get_content_type() == "text/plain":
+                    return part.get_payload(decode=True).decode()
+        return message.get_payload(decode=True).decode() if message.get_payload() else ""
+
+def open_pst_folder(pst: pypff.file, folder_path: Tuple[int, ...]) -> pypff.folder:
+    """Walk from the root folder to the folder addressed by sub-folder indices."""
+    folder = pst.get_root_folder()
+    for index in folder_path:
+        folder = folder.get_sub_folder(index)
+    return folder
+
+def parse_pst_range(file_path: str, folder_path: Tuple[int, ...], start: int, end: int,
+                    known: Optional[Callable[[str], bool]] = None) -> Tuple[List[Dict[str, Any]], int]:
+    """Parse messages [start, end) of one PST folder in a pool worker.
+
+    Each call opens its own pypff handle; returns the parsed records and
+    the number of messages that failed to parse.
+    """
+    parser = MessageParser(known)
+    records = []
+    failures = 0
+    pst = pypff.file()
+    pst.open(file_path)
+    try:
+        folder = open_pst_folder(pst, folder_path)
+        for i in range(start, end):
+            try:
+                records.append(parser.parse_pst_message(folder.get_message(i)))
+            except Exception as e:
+                failures += 1
+                print(f"Error processing message: {e}")
+    finally:
+        pst.close()
+    return records, failures
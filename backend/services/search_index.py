@@ -0,0 +1,167 @@
+import re
+from collections import defaultdict
+from typing import Dict, Any, List, Iterable, Optional
+from sqlalchemy import text, select, inspect, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import models
+from services.identity_cache import chunked
+
+# Relative weight of subject, body and attachment text when ranking matches
+SQLITE_WEIGHTS = "10.0, 1.0, 0.5"
+SNIPPET_WORDS = 16
+QUERY_TOKEN = re.compile(r'(\w+)(\*?)', re.UNICODE)
+
+def create_search_index(engine: Engine) -> None:
+    """Create the full-text index table for the engine's dialect, backfilling it when new.
+
+    SQLite uses an FTS5 virtual table with the email id as rowid; Postgres a
+    weighted tsvector column with a GIN index. Other databases fall back to
+    unindexed LIKE matching.
+    """
+    dialect = engine.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return
+    created = not inspect(engine).has_table('email_search')
+    with engine.begin() as conn:
+        if dialect == 'sqlite':
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS email_search "
+                "USING fts5(subject, body, attachments, tokenize='porter unicode61')"
+            ))
+        else:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS email_search ("
+                "email_id INTEGER PRIMARY KEY REFERENCES emails(id) ON DELETE CASCADE, "
+                "document TSVECTOR NOT NULL)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_email_search_document ON email_search USING GIN (document)"
+            ))
+    if created:
+        with Session(engine) as db:
+            SearchIndex(db).rebuild()
+            db.commit()
+
+class SearchIndex:
+    """Keeps the full-text index over email subject, body and attachment text in step with the tables.
+
+    Writes run inside the caller's transaction; callers commit.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.dialect = db.get_bind().dialect.name
+
+    def index_emails(self, documents: List[Dict[str, Any]]) -> None:
+        """Add or replace index entries from dicts with id, subject, body and attachments."""
+        if not documents or self.dialect not in ('sqlite', 'postgresql'):
+            return
+        rows = [{
+            'id': document['id'],
+            'subject': document.get('subject') or "",
+            'body': document.get('body') or "",
+            'attachments': document.get('attachments') or ""
+        } for document in documents]
+
+        if self.dialect == 'sqlite':
+            self.db.execute(text("DELETE FROM email_search WHERE rowid = :id"), rows)
+            self.db.execute(text(
+                "INSERT INTO email_search (rowid, subject, body, attachments) "
+                "VALUES (:id, :subject, :body, :attachments)"
+            ), rows)
+        else:
+            self.db.execute(text(
+                "INSERT INTO email_search (email_id, document) VALUES (:id, "
+                "setweight(to_tsvector('english', :subject), 'A') || "
+                "setweight(to_tsvector('english', :body), 'B') || "
+                "setweight(to_tsvector('english', :attachments), 'C')) "
+                "ON CONFLICT (email_id) DO UPDATE SET document = EXCLUDED.document"
+            ), rows)
+
+    def reindex_emails(self, email_ids: Iterable[int]) -> None:
+        """Rebuild index entries for emails, e.g. after their attachments gained text."""
+        for chunk in chunked(sorted(set(email_ids))):
+            attachment_text = defaultdict(list)
+            for email_id, extracted_text in self.db.execute(
+                select(models.Attachment.email_id, models.Attachment.extracted_text).where(
+                    models.Attachment.email_id.in_(chunk),
+                    models.Attachment.extracted_text != None
+                ).order_by(models.Attachment.id)
+            ):
+                attachment_text[email_id].append(extracted_text)
+
+            self.index_emails([
+                {
+                    'id': row.id,
+                    'subject': row.subject,
+                    'body': row.body,
+                    'attachments': "\n".join(attachment_text.get(row.id, []))
+                }
+                for row in self.db.execute(
+                    select(models.Email.id, models.Email.subject, models.Email.body)
+                    .where(models.Email.id.in_(chunk))
+                )
+            ])
+
+    def reindex_attachments(self, content_hashes: Iterable[str]) -> None:
+        """Rebuild index entries for every email carrying one of the given payloads."""
+        email_ids = set()
+        for chunk in chunked(list(set(content_hashes))):
+            email_ids.update(self.db.scalars(
+                select(models.Attachment.email_id).where(models.Attachment.content_hash.in_(chunk))
+            ))
+        self.reindex_emails(email_ids)
+
+    def rebuild(self, batch_size: int = 1000) -> None:
+        """Index every email, paging by id."""
+        last_id = 0
+        while True:
+            email_ids = self.db.scalars(
+                select(models.Email.id).where(models.Email.id > last_id)
+                .order_by(models.Email.id).limit(batch_size)
+            ).all()
+            if not email_ids:
+                break
+            last_id = email_ids[-1]
+            self.reindex_emails(email_ids)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        """Return ranked matches as dicts with email_id, score and snippet, best first."""
+        if self.dialect == 'sqlite':
+            match = self._fts_query(query)
+            if not match:
+                return []
+            rows = self.db.execute(text(
+                f"SELECT rowid AS email_id, -bm25(email_search, {SQLITE_WEIGHTS}) AS score, "
+                f"snippet(email_search, -1, '[', ']', '...', {SNIPPET_WORDS}) AS snippet "
+                "FROM email_search WHERE email_search MATCH :match "
+                f"ORDER BY bm25(email_search, {SQLITE_WEIGHTS}) LIMIT :limit OFFSET :offset"
+            ), {'match': match, 'limit': limit, 'offset': offset})
+        elif self.dialect == 'postgresql':
+            rows = self.db.execute(text(
+                "SELECT s.email_id, ts_rank_cd(s.document, q) AS score, "
+                "ts_headline('english', coalesce(e.body, ''), q, "
+                f"'StartSel=[, StopSel=], MaxWords={SNIPPET_WORDS}, MinWords=5') AS snippet "
+                "FROM email_search s JOIN emails e ON e.id = s.email_id, "
+                "websearch_to_tsquery('english', :query) q "
+                "WHERE s.document @@ q ORDER BY score DESC, s.email_id LIMIT :limit OFFSET :offset"
+            ), {'query': query, 'limit': limit, 'offset': offset})
+        else:
+            pattern = f"%{query}%"
+            rows = self.db.execute(
+                select(models.Email.id.label('email_id'), func.substr(models.Email.body, 1, 200).label('snippet'))
+                .where(models.Email.subject.ilike(pattern) | models.Email.body.ilike(pattern))
+                .order_by(models.Email.received_date.desc()).limit(limit).offset(offset)
+            )
+            return [{'email_id': row.email_id, 'score': None, 'snippet': row.snippet} for row in rows]
+
+        return [
+            {'email_id': row.email_id, 'score': round(float(row.score), 4), 'snippet': row.snippet}
+            for row in rows
+        ]
+
+    def _fts_query(self, query: str) -> Optional[str]:
+        """Turn free text into an FTS5 query: every word must match, a trailing * matches a prefix."""
+        terms = [f'"{word}"{star}' for word, star in QUERY_TOKEN.findall(query)]
+        return " ".join(terms) or None
@@ -1,89 +1,418 @@
 import os
-from typing import Optional
-from PyPDF2 import PdfReader
-from docx import Document
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, List, Set, Tuple, Iterator
 import logging
+from sqlalchemy import update, bindparam, insert, delete, select, or_, and_
 from sqlalchemy.orm import Session
 import models
+from config import settings
+from services.extractors import sniff, get_extractor, current_tags
+from services.search_index import SearchIndex
+from services.identity_cache import chunked
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Extra seconds a worker gets past extraction_timeout before it is killed; the
+# budget checks inside extractors normally stop it first
+HARD_TIMEOUT_GRACE = 10.0
+
+Extracted = Tuple[Optional[List[str]], Optional[str], Optional[str]]
+
+def extract_file_pages(file_path: str, content_type: Optional[str]) -> Extracted:
+    """Pool worker entry point: returns (page texts, extractor tag, error message); pages is None for unsupported formats."""
+    try:
+        return (*TextExtractionService().extract_document(file_path, content_type or ""), None)
+    except Exception as e:
+        return None, None, str(e)
+
+class ExtractionPool:
+    """Spawn-context process pool for extract_file_pages that can kill stuck workers.
+
+    Extraction budgets are only checked between pages, so a parser that hangs
+    inside one page never returns. Each result is awaited with a hard timeout;
+    on timeout (or a crashed worker) the pool's processes are terminated, the
+    pool is recreated and the unfinished rest of the batch is resubmitted.
+    Blobs that were in flight when a worker crashed are rerun one at a time,
+    so only the blob that crashes on its own is blamed. Blobs that were
+    killed or crashed a worker are collected in self.killed.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = self._new_executor()
+        self.killed: Set[int] = set()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def extract(self, blobs: List) -> Dict[int, Extracted]:
+        """Extract each blob's pages; returns extract_file_pages results keyed by blob id."""
+        limit = settings.extraction_timeout + HARD_TIMEOUT_GRACE
+        results = {}
+        self.killed = set()
+        queue = list(blobs)
+        suspects = []
+        while queue or suspects:
+            if suspects:
+                batch, suspects = suspects[:1], suspects[1:]
+            else:
+                batch, queue = queue, []
+            futures = [
+                (blob, self.executor.submit(extract_file_pages, blob.storage_path, blob.content_type))
+                for blob in batch
+            ]
+            for i, (blob, future) in enumerate(futures):
+                try:
+                    results[blob.id] = future.result(timeout=limit)
+                    continue
+                except FutureTimeoutError:
+                    # Dispatch is FIFO and earlier blobs are done, so this one really ran past the limit
+                    self._kill(results, blob, f"Extraction killed after {limit:.0f}s")
+                    unfinished = futures[i + 1:]
+                    crashed = False
+                except BrokenProcessPool as e:
+                    if len(batch) == 1:
+                        self._kill(results, blob, f"Extraction worker crashed: {e}")
+                        unfinished = []
+                    else:
+                        unfinished = futures[i:]
+                    crashed = len(batch) > 1
+                self.restart()
+                leftover = []
+                for other, other_future in unfinished:
+                    if other_future.done() and not other_future.cancelled() and other_future.exception() is None:
+                        results[other.id] = other_future.result()
+                    else:
+                        leftover.append(other)
+                if crashed:
+                    # Only the first workers + 1 unfinished blobs had been handed to a worker
+                    in_flight = self.workers + 1
+                    suspects.extend(leftover[:in_flight])
+                    leftover = leftover[in_flight:]
+                queue.extend(leftover)
+                break
+        return results
+
+    def _kill(self, results: Dict, blob, error: str) -> None:
+        results[blob.id] = (None, None, error)
+        self.killed.add(blob.id)
+
+    def restart(self) -> None:
+        """Terminate every worker, including a stuck one, and start a fresh pool."""
+        for process in list((self.executor._processes or {}).values()):
+            process.terminate()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = self._new_executor()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+
 class TextExtractionService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Optional[Session] = None):
         self.db = db
     
+    def extract_text(self, file_path: str, content_type: Optional[str] = None) -> Optional[str]:
+        """Extract text from a file on disk"""
+        return self._extract_text(file_path, content_type or "")
+    
+    def process_blob(self, blob: models.AttachmentBlob) -> bool:
+        """Extract text once for a stored payload and share it with every attachment pointing at it"""
+        if not os.path.exists(blob.storage_path):
+            logger.error(f"Attachment blob {blob.sha256} missing from storage")
+            return False
+        
+        try:
+            pages, tag = self.extract_document(blob.storage_path, blob.content_type or "")
+            text = "\n".join(pages) if pages else None
+            blob.extracted_text = text
+            blob.processed = True
+            blob.extractor_version = tag
+            blob.extraction_error = None
+            self._store_pages([(blob.id, pages)])
+            self.db.query(models.Attachment).filter(
+                models.Attachment.content_hash == blob.sha256
+            ).update({"extracted_text": text, "processed": True}, synchronize_session=False)
+            self._mark_embeddings_stale([blob.sha256])
+            if text:
+                SearchIndex(self.db).reindex_attachments([blob.sha256])
+            self.db.commit()
+            
+            if not text:
+                logger.warning(f"No text extracted from attachment blob {blob.sha256}")
+            return bool(text)
+            
+        except Exception as e:
+            logger.error(f"Error processing attachment blob {blob.sha256}: {str(e)}")
+            self.db.rollback()
+            return False
+    
     def process_attachment(self, attachment_id: int) -> bool:
         """Process a single attachment and extract its text"""
         attachment = self.db.query(models.Attachment).filter(
             models.Attachment.id == attachment_id
         ).first()
         
-        if not attachment or not os.path.exists(attachment.storage_path):
-            logger.error(f"Attachment {attachment_id} not found or file missing")
+        if not attachment:
+            logger.error(f"Attachment {attachment_id} not found")
+            return False
+        
+        if attachment.blob:
+            return self.process_blob(attachment.blob)
+        
+        if not attachment.storage_path or not os.path.exists(attachment.storage_path):
+            logger.error(f"Attachment {attachment_id} file missing")
             return False
         
         try:
-            # Extract text based on file type
-            text = self._extract_text(attachment.storage_path, attachment.content_type)
+            text = self._extract_text(attachment.storage_path, attachment.content_type or "")
+            attachment.extracted_text = text
+            attachment.processed = True
+            self.db.query(models.Email).filter(
+                models.Email.id == attachment.email_id
+            ).update({"embedding_stale": True}, synchronize_session=False)
             if text:
-                attachment.text_content = text
-                attachment.text_extracted = True
-                self.db.commit()
-                return True
-            
-            logger.warning(f"No text extracted from attachment {attachment_id}")
-            return False
-            
+                self.db.flush()
+                SearchIndex(self.db).reindex_emails([attachment.email_id])
+            self.db.commit()
+            return bool(text)
         except Exception as e:
             logger.error(f"Error processing attachment {attachment_id}: {str(e)}")
             self.db.rollback()
             return False
     
-    def process_unextracted_attachments(self) -> dict:
-        """Process all attachments that haven't had text extracted yet"""
-        attachments = self.db.query(models.Attachment).filter(
-            models.Attachment.text_extracted == False
-        ).all()
+    def process_unextracted_attachments(self, workers: Optional[int] = None,
+                                        batch_size: Optional[int] = None) -> dict:
+        """Extract text for every stored payload that hasn't been processed yet,
+        or whose text came from an older version of its extractor.
+        
+        Blobs are paged in id order, extracted across an ExtractionPool and
+        committed one batch at a time; a blob whose extraction hangs is
+        killed and counted as failed. Each payload is extracted once per
+        extractor version: blob rows are unique per SHA-256 and new
+        attachments of an extracted payload inherit its text at ingestion.
+        Blobs that were killed or crashed a worker are marked processed
+        with their extraction_error so later runs skip them; other failures
+        stay unprocessed and the next run retries them.
+        """
+        workers = workers or settings.extraction_workers
+        batch_size = batch_size or settings.extraction_batch_size
+        results = {"total": 0, "success": 0, "empty": 0, "failed": 0, "bytes": 0}
+        started = time.monotonic()
         
-        results = {"success": 0, "failed": 0, "total": len(attachments)}
+        tags = current_tags()
+        pool = ExtractionPool(workers)
+        try:
+            last_id = 0
+            while True:
+                blobs = self.db.query(
+                    models.AttachmentBlob.id,
+                    models.AttachmentBlob.sha256,
+                    models.AttachmentBlob.storage_path,
+                    models.AttachmentBlob.content_type,
+                    models.AttachmentBlob.size
+                ).filter(
+                    or_(
+                        models.AttachmentBlob.processed == False,
+                        and_(models.AttachmentBlob.extractor_version != None,
+                             models.AttachmentBlob.extractor_version.notin_(tags),
+                             models.AttachmentBlob.extraction_error == None)
+                    ),
+                    models.AttachmentBlob.id > last_id
+                ).order_by(models.AttachmentBlob.id).limit(batch_size).all()
+                if not blobs:
+                    break
+                last_id = blobs[-1].id
+                
+                extracted = pool.extract(blobs)
+                self._save_batch(blobs, [extracted[blob.id] for blob in blobs], results, pool.killed)
+        finally:
+            pool.shutdown()
         
-        for attachment in attachments:
-            success = self.process_attachment(attachment.id)
-            if success:
+        # Attachments stored before content addressing have no blob
+        legacy_ids = [row.id for row in self.db.query(models.Attachment.id).filter(
+            models.Attachment.processed == False,
+            models.Attachment.content_hash == None
+        )]
+        for attachment_id in legacy_ids:
+            results["total"] += 1
+            if self.process_attachment(attachment_id):
                 results["success"] += 1
             else:
                 results["failed"] += 1
         
+        results["processed"] = results["success"] + results["empty"]
+        elapsed = time.monotonic() - started
+        results["elapsed_seconds"] = round(elapsed, 2)
+        results["attachments_per_second"] = round(results["total"] / elapsed, 2) if elapsed > 0 else 0.0
+        results["megabytes_per_second"] = round(results["bytes"] / elapsed / 1024 / 1024, 2) if elapsed > 0 else 0.0
         return results
     
+    def _save_batch(self, blobs: List, extracted: List[Extracted], results: dict,
+                    killed: Set[int]) -> None:
+        """Persist one batch of extraction results in a single transaction"""
+        done = []
+        pages_by_blob = []
+        poisoned = []
+        for blob, (pages, tag, error) in zip(blobs, extracted):
+            results["total"] += 1
+            if error:
+                results["failed"] += 1
+                logger.error(f"Error processing attachment blob {blob.sha256}: {error}")
+                if blob.id in killed:
+                    poisoned.append({"blob_id": blob.id, "error": error})
+                continue
+            text = "\n".join(pages) if pages else None
+            results["bytes"] += blob.size or 0
+            results["success" if text else "empty"] += 1
+            done.append({"blob_id": blob.id, "blob_sha256": blob.sha256, "text": text, "tag": tag})
+            pages_by_blob.append((blob.id, pages))
+        if not done and not poisoned:
+            return
+        
+        blob_table = models.AttachmentBlob.__table__
+        attachment_table = models.Attachment.__table__
+        try:
+            if poisoned:
+                self.db.execute(
+                    update(blob_table)
+                    .where(blob_table.c.id == bindparam("blob_id"))
+                    .values(processed=True, extraction_error=bindparam("error")),
+                    poisoned
+                )
+            if done:
+                self.db.execute(
+                    update(blob_table)
+                    .where(blob_table.c.id == bindparam("blob_id"))
+                    .values(extracted_text=bindparam("text"), processed=True,
+                            extractor_version=bindparam("tag"), extraction_error=None),
+                    done
+                )
+                self.db.execute(
+                    update(attachment_table)
+                    .where(attachment_table.c.content_hash == bindparam("blob_sha256"))
+                    .values(extracted_text=bindparam("text"), processed=True),
+                    done
+                )
+                self._store_pages(pages_by_blob)
+                self._mark_embeddings_stale([row["blob_sha256"] for row in done])
+                SearchIndex(self.db).reindex_attachments([row["blob_sha256"] for row in done if row["text"]])
+            self.db.commit()
+        except Exception as e:
+            logger.error(f"Error saving extracted text for {len(done)} attachment blobs: {str(e)}")
+            self.db.rollback()
+            results["success"] -= sum(1 for row in done if row["text"])
+            results["empty"] -= sum(1 for row in done if not row["text"])
+            results["failed"] += len(done)
+    
+    def _mark_embeddings_stale(self, content_hashes: List[str]) -> None:
+        """Flag the emails carrying these payloads so the next embedding run picks up their new text"""
+        for chunk in chunked(content_hashes):
+            self.db.execute(
+                update(models.Email)
+                .where(models.Email.id.in_(
+                    select(models.Attachment.email_id).where(models.Attachment.content_hash.in_(chunk))
+                ))
+                .values(embedding_stale=True)
+            )
+    
+    def _store_pages(self, pages_by_blob: List[Tuple[int, Optional[List[str]]]]) -> None:
+        """Persist per-page text for multi-page documents so ranges can be read without re-parsing.
+
+        Pages from an earlier extraction of the same blobs are replaced.
+        """
+        if not pages_by_blob:
+            return
+        rows = [
+            {"blob_id": blob_id, "page_number": number, "text": text}
+            for blob_id, pages in pages_by_blob if pages and len(pages) > 1
+            for number, text in enumerate(pages, start=1)
+        ]
+        page_table = models.AttachmentPage.__table__
+        self.db.execute(delete(page_table).where(page_table.c.blob_id.in_([blob_id for blob_id, _ in pages_by_blob])))
+        if rows:
+            self.db.execute(insert(page_table), rows)
+    
+    def read_pages(self, blob_id: int, start: int = 1, end: Optional[int] = None) -> List[Tuple[int, str]]:
+        """Read stored page text for pages start..end (inclusive)"""
+        query = self.db.query(models.AttachmentPage.page_number, models.AttachmentPage.text).filter(
+            models.AttachmentPage.blob_id == blob_id,
+            models.AttachmentPage.page_number >= start
+        )
+        if end is not None:
+            query = query.filter(models.AttachmentPage.page_number <= end)
+        return [(row.page_number, row.text) for row in query.order_by(models.AttachmentPage.page_number)]
+    
+    def read_text(self, attachment: models.Attachment, max_chars: int,
+                  max_pages: Optional[int] = None) -> Optional[str]:
+        """Return up to max_chars of an attachment's text, parsing only as many pages as needed"""
+        if attachment.blob:
+            query = self.db.query(models.AttachmentPage.text).filter(
+                models.AttachmentPage.blob_id == attachment.blob.id
+            ).order_by(models.AttachmentPage.page_number)
+            if max_pages:
+                query = query.limit(max_pages)
+            text = []
+            length = 0
+            for row in query.yield_per(50):
+                text.append(row.text)
+                length += len(row.text) + 1
+                if length >= max_chars:
+                    break
+            if text:
+                return "\n".join(text)[:max_chars]
+        
+        if attachment.extracted_text:
+            return attachment.extracted_text[:max_chars]
+        if not attachment.storage_path:
+            return None
+        
+        pages = self.iter_pages(attachment.storage_path, attachment.content_type or "",
+                                max_pages=max_pages, max_chars=max_chars)
+        return "\n".join(text for _, text in pages) or None
+    
+    def iter_pages(self, file_path: str, content_type: str = "", max_pages: Optional[int] = None,
+                   max_chars: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Lazily yield (page number, text) for a file, honouring page and character budgets"""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        extractor = get_extractor(sniff(file_path, content_type))
+        if not extractor:
+            logger.warning(f"Unsupported file type: {content_type}")
+            return
+        yield from extractor.iter_pages(file_path, max_pages, max_chars)
+    
+    def extract_document(self, file_path: str, content_type: str) -> Tuple[Optional[List[str]], Optional[str]]:
+        """Extract every page's text with the registered extractor; returns (pages, extractor tag), (None, None) if the format is unsupported"""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        extractor = get_extractor(sniff(file_path, content_type))
+        if not extractor:
+            logger.warning(f"Unsupported file type: {content_type}")
+            return None, None
+        return [text for _, text in extractor.iter_pages(file_path)], extractor.tag
+    
+    def extract_text_or_raise(self, file_path: str, content_type: str) -> Optional[str]:
+        """Extract text with the registered extractor for the file's sniffed format, letting errors propagate"""
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(file_path)
+        
+        extractor = get_extractor(sniff(file_path, content_type))
+        if not extractor:
+            logger.warning(f"Unsupported file type: {content_type}")
+            return None
+        return extractor.extract(file_path)
+    
     def _extract_text(self, file_path: str, content_type: str) -> Optional[str]:
         """Extract text from a file based on its content type"""
         if not os.path.exists(file_path):
             return None
             
         try:
-            if "pdf" in content_type.lower():
-                return self._extract_pdf_text(file_path)
-            elif "word" in content_type.lower() or file_path.endswith(".docx"):
-                return self._extract_docx_text(file_path)
-            else:
-                logger.warning(f"Unsupported file type: {content_type}")
-                return None
+            return self.extract_text_or_raise(file_path, content_type)
         except Exception as e:
             logger.error(f"Error extracting text from {file_path}: {str(e)}")
             return None
-    
-    def _extract_pdf_text(self, file_path: str) -> str:
-        """Extract text from a PDF file"""
-        text = []
-        with open(file_path, "rb") as file:
-            pdf = PdfReader(file)
-            for page in pdf.pages:
-                text.append(page.extract_text())
-        return "\n".join(text)
-    
-    def _extract_docx_text(self, file_path: str) -> str:
-        """Extract text from a DOCX file"""
-        doc = Document(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
@@ -0,0 +1,171 @@
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import insert, select, update, bindparam
+from sqlalchemy.orm import Session
+import models
+from config import settings
+from services.identity_cache import chunked
+
+# Reply, forward and mailing-list tag prefixes, any number of them
+SUBJECT_PREFIX = re.compile(r'^\s*((re|fw|fwd|aw|sv|wg|antw)(\[\d+\])?\s*:|\[[^\]]{1,40}\])\s*', re.IGNORECASE)
+REPLY_PREFIX = re.compile(r'^(re|fw|fwd|aw|sv|wg|antw)', re.IGNORECASE)
+
+def normalize_subject(subject: str) -> Tuple[str, bool]:
+    """Strip Re:/Fwd:/[list] prefixes; returns the base subject and whether it was a reply or forward."""
+    subject = subject or ""
+    is_reply = False
+    while True:
+        match = SUBJECT_PREFIX.match(subject)
+        if not match:
+            break
+        is_reply = is_reply or bool(REPLY_PREFIX.match(match.group(1)))
+        subject = subject[match.end():]
+    return " ".join(subject.lower().split()), is_reply
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Naive UTC, so header dates with and without an offset compare."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class ThreadIndex:
+    """Incremental JWZ-style conversation threading for the bulk writer.
+
+    Every Message-ID an email has or refers to (In-Reply-To, References)
+    maps to a thread id, kept in memory and persisted in thread_keys, so
+    a reply joins its parent's thread even when the parent arrives later
+    or came from another mailbox. An email that links two threads merges
+    them, and the merged thread's rows are updated in place. Emails with
+    nothing to link on fall back to their normalized subject when they
+    are replies sent within thread_subject_window_days of that thread.
+    Like IdentityCache, entries made inside a transaction stay pending
+    until commit().
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.keys: Dict[str, Tuple[str, Optional[datetime]]] = {}
+        self.merged: Dict[str, str] = {}
+        self.pending_keys: Dict[str, Tuple[str, Optional[datetime]]] = {}
+        self.pending_merged: Dict[str, str] = {}
+
+    def assign(self, records: List[Dict[str, Any]]) -> List[str]:
+        """Return a thread id per record, persisting new keys and merges in the current transaction."""
+        subjects = [normalize_subject(record['subject']) for record in records]
+        self._load([
+            key for record, (subject, _) in zip(records, subjects)
+            for key in self._message_keys(record) + ([f"subject:{subject}"] if subject else [])
+        ])
+
+        thread_ids = []
+        for record, (subject, is_reply) in zip(records, subjects):
+            message_keys = self._message_keys(record)
+            linked = []
+            for key in message_keys:
+                entry = self._get(key)
+                if entry and self._find(entry[0]) not in linked:
+                    linked.append(self._find(entry[0]))
+
+            date = _utc(record['received_date'])
+            subject_key = f"subject:{subject}" if subject else None
+            if not linked and subject_key and is_reply:
+                entry = self._get(subject_key)
+                if entry and self._recent(entry[1], date):
+                    linked.append(self._find(entry[0]))
+
+            thread_id = linked[0] if linked else uuid.uuid4().hex
+            if len(linked) > 1:
+                self._merge(thread_id, linked[1:])
+            for key in message_keys:
+                self.pending_keys[key] = (thread_id, None)
+            if subject_key:
+                previous = self._get(subject_key)
+                dates = [date]
+                if previous and self._find(previous[0]) == thread_id:
+                    dates.append(previous[1])
+                dates = [value for value in dates if value]
+                self.pending_keys[subject_key] = (thread_id, max(dates) if dates else None)
+            thread_ids.append(thread_id)
+
+        self._persist()
+        # Threads merged later in the batch take their survivor's id
+        return [self._find(thread_id) for thread_id in thread_ids]
+
+    def commit(self) -> None:
+        """Promote keys and merges made in the committed transaction."""
+        self.keys.update(self.pending_keys)
+        self.merged.update(self.pending_merged)
+        self.pending_keys.clear()
+        self.pending_merged.clear()
+
+    def rollback(self) -> None:
+        """Forget keys and merges made in a transaction that was rolled back."""
+        self.pending_keys.clear()
+        self.pending_merged.clear()
+
+    def _message_keys(self, record: Dict[str, Any]) -> List[str]:
+        """The record's references root first, then its parent, then its own Message-ID."""
+        keys = list(record.get('references') or [])
+        for message_id in (record.get('in_reply_to'), record.get('message_id')):
+            if message_id and message_id not in keys:
+                keys.append(message_id)
+        return keys
+
+    def _get(self, key: str) -> Optional[Tuple[str, Optional[datetime]]]:
+        return self.pending_keys.get(key) or self.keys.get(key)
+
+    def _find(self, thread_id: str) -> str:
+        while True:
+            parent = self.pending_merged.get(thread_id) or self.merged.get(thread_id)
+            if not parent:
+                return thread_id
+            thread_id = parent
+
+    def _recent(self, last_date: Optional[datetime], date: Optional[datetime]) -> bool:
+        if not last_date or not date:
+            return True
+        return abs(date - last_date) <= timedelta(days=settings.thread_subject_window_days)
+
+    def _load(self, keys: List[str]) -> None:
+        """Fetch keys missing from memory with one SELECT per chunk."""
+        missing = list({key for key in keys if self._get(key) is None})
+        for chunk in chunked(missing):
+            rows = self.db.execute(
+                select(models.ThreadKey.key, models.ThreadKey.thread_id, models.ThreadKey.last_date)
+                .where(models.ThreadKey.key.in_(chunk))
+            )
+            for key, thread_id, last_date in rows:
+                self.keys[key] = (thread_id, last_date)
+
+    def _merge(self, survivor: str, others: List[str]) -> None:
+        """Fold other threads into survivor, rewriting their persisted emails and keys."""
+        for other in others:
+            self.pending_merged[other] = survivor
+        for table in (models.Email.__table__, models.ThreadKey.__table__):
+            self.db.execute(
+                update(table).where(table.c.thread_id.in_(others)).values(thread_id=survivor)
+            )
+
+    def _persist(self) -> None:
+        """Insert new keys and rewrite known keys whose thread or date changed."""
+        rows = [
+            {'key': key, 'thread_id': self._find(thread_id), 'last_date': last_date}
+            for key, (thread_id, last_date) in self.pending_keys.items()
+        ]
+        new_rows = [row for row in rows if row['key'] not in self.keys]
+        changed_rows = [
+            {'key_value': row['key'], 'new_thread_id': row['thread_id'], 'new_last_date': row['last_date']}
+            for row in rows
+            if row['key'] in self.keys and self.keys[row['key']] != (row['thread_id'], row['last_date'])
+        ]
+        if new_rows:
+            self.db.execute(insert(models.ThreadKey), new_rows)
+        if changed_rows:
+            table = models.ThreadKey.__table__
+            self.db.execute(
+                update(table).where(table.c.key == bindparam('key_value'))
+                .values(thread_id=bindparam('new_thread_id'), last_date=bindparam('new_last_date')),
+                changed_rows
+            )
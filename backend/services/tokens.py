@@ -0,0 +1,88 @@
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+# Word pieces and single punctuation marks, roughly how BPE tokenizers split text
+PIECE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+CHARS_PER_WORD_TOKEN = 6
+
+# Where the quoted history of a reply starts
+REPLY_HEADER = re.compile(
+    r"^\s*(On .{0,200}wrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|From:\s.+$\n^\s*(Sent|Date):\s)",
+    re.IGNORECASE | re.MULTILINE
+)
+
+@lru_cache(maxsize=8)
+def _encoding(model: Optional[str]):
+    """The tiktoken encoding for a model, or None when tiktoken or its data files are unavailable."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            return None
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Count tokens offline, exactly with tiktoken when installed, otherwise by estimate.
+
+    The estimate counts punctuation as one token and words as one token per
+    six characters; on English mail it slightly overestimates cl100k counts,
+    which is the safe side for prompt budgets.
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(
+        -(-len(piece) // CHARS_PER_WORD_TOKEN) if piece[0].isalnum() or piece[0] == "_" else 1
+        for piece in PIECE.findall(text)
+    )
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Cut text to at most max_tokens tokens."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _encoding(model)
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    # Shrink by the observed ratio until it fits
+    while text and count_tokens(text, model) > max_tokens:
+        text = text[:int(len(text) * max_tokens / count_tokens(text, model) * 0.95)]
+    return text
+
+def strip_quoted_reply(body: str) -> str:
+    """Drop the quoted history of a reply: '>' lines and everything after a reply or forward header."""
+    if not body:
+        return ""
+    match = REPLY_HEADER.search(body)
+    if match and match.start() > 0:
+        body = body[:match.start()]
+    lines = [line for line in body.splitlines() if not line.lstrip().startswith(">")]
+    return "\n".join(lines).strip()
+
+def split_by_tokens(texts: List[str], max_tokens: int, model: Optional[str] = None) -> List[List[str]]:
+    """Group consecutive texts into chunks of at most max_tokens; oversized texts are truncated."""
+    chunks = []
+    current, current_tokens = [], 0
+    for text in texts:
+        tokens = count_tokens(text, model)
+        if tokens > max_tokens:
+            text = truncate_to_tokens(text, max_tokens, model)
+            tokens = max_tokens
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,110 @@
+import os
+import re
+import zlib
+from typing import Dict, Any, List, Optional
+import numpy as np
+from config import settings
+
+# Headers the triage stage reads, lowercased
+TRIAGE_HEADERS = (
+    'list-unsubscribe', 'list-id', 'precedence', 'auto-submitted',
+    'x-auto-response-suppress', 'x-campaign', 'x-mailer', 'feedback-id'
+)
+
+TOKEN = re.compile(r"[a-z0-9$']+|%")
+FEATURE_BITS = 18
+TEXT_SCORE_LIMIT = 6.0  # caps how far the text alone can move an email
+NO_REPLY = re.compile(r'^(no-?reply|do-?not-?reply|notifications?|mailer-daemon|postmaster|bounce|news(letter)?|marketing|alerts?)[@+.-]')
+
+# Starting weights for the text model; negative means bulk or automated mail
+SEED_WEIGHTS = {
+    'unsubscribe': -3.0, 'newsletter': -2.0, 'webinar': -1.5, 'promotion': -1.5, 'promo': -1.5,
+    'sale': -1.0, 'offer': -1.0, 'discount': -1.5, '%': -1.0, 'deal': -1.0, 'deals': -1.0,
+    'browser': -1.0, 'view in browser': -2.0, 'privacy policy': -1.5, 'manage preferences': -2.5,
+    'email preferences': -2.5, 'no longer wish': -2.5, 'automated message': -2.5,
+    'do not reply': -2.5, 'notification': -1.0, 'digest': -1.5, 'receipt': -0.5,
+    'you': 0.2, 'please': 0.8, 'thanks': 0.5, 'meeting': 1.0, 'call': 0.5, 'attached': 1.0,
+    'review': 0.8, 'contract': 1.2, 'invoice': 0.5, 'question': 0.8, 'can you': 1.2,
+    'let me know': 1.2, 'could you': 1.2, 'agreement': 1.0, 'proposal': 1.0,
+}
+URGENT = re.compile(r'\b(urgent|asap|immediately|deadline|overdue|final notice|escalat\w*|time.sensitive)\b', re.IGNORECASE)
+
+def _feature_index(feature: str) -> int:
+    return zlib.crc32(feature.encode('utf-8')) & ((1 << FEATURE_BITS) - 1)
+
+def _features(text: str) -> List[str]:
+    words = TOKEN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])] + [
+        " ".join(words[i:i + 3]) for i in range(len(words) - 2)
+    ]
+
+class TriageClassifier:
+    """Tags emails 'low', 'normal' or 'high' importance before any LLM spend.
+
+    Mailing-list and auto-generated headers (List-Unsubscribe, Precedence,
+    Auto-Submitted, ...) and no-reply senders are strong 'low' signals. The
+    text model is a hashed-feature linear scorer over subject and body
+    words, bigrams and trigrams, scored a whole batch at a time with one
+    numpy gather and bincount. Bodies are scored on their head and tail,
+    where greetings, asks and unsubscribe footers sit. Weights start from
+    SEED_WEIGHTS and can be replaced by a trained vector saved with numpy
+    at triage_model_path.
+    """
+
+    def __init__(self, model_path: Optional[str] = None):
+        model_path = settings.triage_model_path if model_path is None else model_path
+        if model_path and os.path.exists(model_path):
+            self.weights = np.load(model_path).astype(np.float32)
+        else:
+            self.weights = np.zeros(1 << FEATURE_BITS, dtype=np.float32)
+            for feature, weight in SEED_WEIGHTS.items():
+                self.weights[_feature_index(feature)] = weight
+
+    def header_score(self, headers: Dict[str, str], sender: str) -> float:
+        score = 0.0
+        if headers.get('list-unsubscribe') or headers.get('list-id'):
+            score -= 4.0
+        if headers.get('precedence', '').strip().lower() in ('bulk', 'list', 'junk'):
+            score -= 4.0
+        if headers.get('auto-submitted', 'no').strip().lower() != 'no':
+            score -= 5.0
+        if headers.get('x-auto-response-suppress') or headers.get('x-campaign') or headers.get('feedback-id'):
+            score -= 2.0
+        if NO_REPLY.match(sender or ''):
+            score -= 3.0
+        return score
+
+    def text_scores(self, texts: List[str]) -> np.ndarray:
+        """Score many texts at once: the sum of their feature weights, capped at +/-TEXT_SCORE_LIMIT."""
+        features = [_features(text) for text in texts]
+        counts = np.array([len(f) for f in features], dtype=np.int64)
+        if not counts.sum():
+            return np.zeros(len(texts), dtype=np.float32)
+        indexes = np.fromiter(
+            (_feature_index(feature) for doc in features for feature in doc),
+            dtype=np.int64, count=int(counts.sum())
+        )
+        doc_ids = np.repeat(np.arange(len(texts)), counts)
+        totals = np.bincount(doc_ids, weights=self.weights[indexes], minlength=len(texts))
+        return np.clip(totals, -TEXT_SCORE_LIMIT, TEXT_SCORE_LIMIT).astype(np.float32)
+
+    def _excerpt(self, body: str) -> str:
+        half = settings.triage_body_chars // 2
+        return body if len(body) <= 2 * half else f"{body[:half]}\n{body[-half:]}"
+
+    def classify(self, records: List[Dict[str, Any]]) -> List[str]:
+        """Return an importance per parsed email record."""
+        if not records:
+            return []
+        texts = [f"{record['subject']}\n{self._excerpt(record['body'] or '')}" for record in records]
+        scores = self.text_scores(texts)
+        importances = []
+        for record, text, text_score in zip(records, texts, scores):
+            score = self.header_score(record.get('triage_headers') or {}, record['sender']) + float(text_score)
+            if score <= settings.triage_low_threshold:
+                importances.append('low')
+            elif URGENT.search(text):
+                importances.append('high')
+            else:
+                importances.append('normal')
+        return importances
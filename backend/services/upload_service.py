@@ -0,0 +1,129 @@
+import os
+import json
+import uuid
+from datetime import datetime
+from typing import Dict, Any, Optional, AsyncIterator, Tuple
+from fastapi import UploadFile
+from config import settings
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload grows past settings.max_upload_size."""
+    pass
+
+class UploadOffsetError(ValueError):
+    """Raised when a resumable chunk does not start where the last one ended."""
+    pass
+
+class UploadService:
+    def __init__(self):
+        self.upload_folder = settings.upload_folder
+        self.partial_folder = os.path.join(self.upload_folder, ".partial")
+        self.chunk_size = settings.upload_chunk_size
+        self.max_size = settings.max_upload_size
+        os.makedirs(self.partial_folder, exist_ok=True)
+
+    async def save_upload(self, file: UploadFile) -> str:
+        """Copy an UploadFile to a unique path in the upload folder in fixed-size chunks."""
+        file_path = self._upload_path(uuid.uuid4().hex, file.filename)
+        written = 0
+        try:
+            with open(file_path, "wb") as buffer:
+                while True:
+                    chunk = await file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > self.max_size:
+                        raise UploadTooLargeError(
+                            f"File exceeds maximum upload size of {self.max_size} bytes"
+                        )
+                    buffer.write(chunk)
+        except Exception:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+        return file_path
+
+    def create_session(self, filename: str, total_size: Optional[int] = None) -> Dict[str, Any]:
+        """Start a resumable upload and return its metadata."""
+        if total_size is not None and total_size > self.max_size:
+            raise UploadTooLargeError(
+                f"File exceeds maximum upload size of {self.max_size} bytes"
+            )
+        upload_id = uuid.uuid4().hex
+        meta = {
+            "upload_id": upload_id,
+            "filename": os.path.basename(filename),
+            "total_size": total_size,
+            "created_at": datetime.utcnow().isoformat()
+        }
+        with open(self._meta_path(upload_id), "w") as f:
+            json.dump(meta, f)
+        open(self._part_path(upload_id), "wb").close()
+        return self.get_session(upload_id)
+
+    def get_session(self, upload_id: str) -> Dict[str, Any]:
+        """Return session metadata including the offset to resume from."""
+        meta_path = self._meta_path(upload_id)
+        if not os.path.exists(meta_path):
+            raise KeyError(upload_id)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta["received"] = os.path.getsize(self._part_path(upload_id))
+        return meta
+
+    async def append_chunk(self, upload_id: str, offset: int, stream: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Append a streamed chunk at the given offset of a resumable upload."""
+        session = self.get_session(upload_id)
+        if offset != session["received"]:
+            raise UploadOffsetError(
+                f"Expected offset {session['received']}, got {offset}"
+            )
+
+        part_path = self._part_path(upload_id)
+        received = offset
+        with open(part_path, "r+b") as buffer:
+            buffer.seek(offset)
+            try:
+                async for chunk in stream:
+                    received += len(chunk)
+                    if received > self.max_size:
+                        raise UploadTooLargeError(
+                            f"File exceeds maximum upload size of {self.max_size} bytes"
+                        )
+                    buffer.write(chunk)
+            finally:
+                # Keep whatever arrived intact so an interrupted chunk can be
+                # resumed from the last byte written.
+                buffer.truncate(buffer.tell())
+
+        session["received"] = received
+        return session
+
+    def complete_session(self, upload_id: str) -> Tuple[str, str]:
+        """Move a finished resumable upload into the upload folder; returns its path and original filename."""
+        session = self.get_session(upload_id)
+        if session["total_size"] is not None and session["received"] != session["total_size"]:
+            raise UploadOffsetError(
+                f"Upload incomplete: {session['received']} of {session['total_size']} bytes"
+            )
+        file_path = self._upload_path(upload_id, session["filename"])
+        os.replace(self._part_path(upload_id), file_path)
+        os.remove(self._meta_path(upload_id))
+        return file_path, session["filename"]
+
+    def abort_session(self, upload_id: str) -> None:
+        """Discard a resumable upload and its partial data."""
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _upload_path(self, upload_id: str, filename: str) -> str:
+        # Prefixed with the upload id so concurrent uploads of the same name never share a file
+        return os.path.join(self.upload_folder, f"{os.path.basename(upload_id)}_{os.path.basename(filename)}")
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.partial_folder, f"{os.path.basename(upload_id)}.part")
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.partial_folder, f"{os.path.basename(upload_id)}.json")
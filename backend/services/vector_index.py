@@ -0,0 +1,224 @@
+import os
+import json
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from config import settings
+
+SCAN_ROWS = 65536  # rows scored per chunk when scanning the matrix
+TRAIN_SAMPLE = 100000  # rows sampled to fit the IVF centroids
+TRAIN_ITERATIONS = 10
+RETRAIN_GROWTH = 0.2  # retrain once this fraction of rows sits outside the IVF lists
+
+class VectorIndex:
+    """Email vectors in an append-only float32 matrix on disk, searched by cosine similarity.
+
+    vectors.f32 and ids.i64 are memory-mapped, so only the rows a query
+    touches are paged in. Once the matrix is large enough an inverted file
+    index (spherical k-means centroids plus per-list row order) limits a
+    query to the rows of the nearest ivf_probes lists; rows appended after
+    training are scanned exhaustively until the next retrain. meta.json
+    is written last and is the commit point for appends. Appending an id
+    that is already indexed supersedes its earlier rows, which searches
+    skip from then on.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.vector_index_path
+        self.lock = threading.RLock()
+        self.backend: Optional[str] = None
+        self.dimension = 0
+        self.count = 0
+        self.trained_count = 0
+        self.max_id = 0
+        self.superseded: Optional[np.ndarray] = None
+        self.vectors: Optional[np.memmap] = None
+        self.ids: Optional[np.memmap] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.order: Optional[np.ndarray] = None
+        self.offsets: Optional[np.ndarray] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def open(self, backend: str, dimension: int) -> None:
+        """Load the index for a backend, starting over if it was built by a different one."""
+        with self.lock:
+            if self.backend == backend and self.dimension == dimension:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            meta = {}
+            if os.path.exists(self._path("meta.json")):
+                with open(self._path("meta.json")) as f:
+                    meta = json.load(f)
+            if meta.get("backend") != backend or meta.get("dimension") != dimension:
+                meta = {"backend": backend, "dimension": dimension, "count": 0, "trained_count": 0}
+                for name in ("vectors.f32", "ids.i64", "ivf.npz"):
+                    if os.path.exists(self._path(name)):
+                        os.remove(self._path(name))
+                self._write_meta(meta)
+
+            self.backend = backend
+            self.dimension = dimension
+            self.count = meta["count"]
+            self.trained_count = meta["trained_count"]
+            # Drop rows from an append that never reached meta.json
+            for name, width in (("vectors.f32", 4 * dimension), ("ids.i64", 8)):
+                with open(self._path(name), "ab") as f:
+                    f.truncate(self.count * width)
+            self._map()
+            self._load_superseded()
+            self._load_ivf()
+
+    def last_id(self) -> int:
+        """The highest email id in the index."""
+        with self.lock:
+            return self.max_id
+
+    def add(self, ids: List[int], vectors: np.ndarray) -> None:
+        """Append vectors for the given email ids, superseding rows already indexed for them."""
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            # Ids above max_id are new, so the common append skips the scan
+            replaced = np.flatnonzero(np.isin(self.ids, ids)) if min(ids) <= self.max_id else []
+            with open(self._path("vectors.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._path("ids.i64"), "ab") as f:
+                f.write(np.asarray(ids, dtype=np.int64).tobytes())
+            self.count += len(ids)
+            self._write_meta()
+            self._map()
+            self.max_id = max(self.max_id, max(ids))
+            if len(replaced) or self.superseded is not None:
+                superseded = np.zeros(self.count, dtype=bool)
+                if self.superseded is not None:
+                    superseded[:len(self.superseded)] = self.superseded
+                superseded[replaced] = True
+                self.superseded = superseded
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Return up to k (email id, cosine similarity) pairs, most similar first."""
+        query = np.asarray(query, dtype=np.float32)
+        with self.lock:
+            if not self.count or k <= 0:
+                return []
+            if self.centroids is None:
+                rows, scores = self._scan(query, k, 0, self.count)
+            else:
+                nearest = np.argsort(-(self.centroids @ query))[:settings.ivf_probes]
+                candidates = [self.order[self.offsets[i]:self.offsets[i + 1]] for i in nearest]
+                candidates.append(np.arange(self.trained_count, self.count))
+                rows = np.sort(np.concatenate(candidates))
+                if self.superseded is not None:
+                    rows = rows[~self.superseded[rows]]
+                scores = self.vectors[rows] @ query
+                rows, scores = self._top(rows, scores, k)
+            return [(int(self.ids[row]), float(score)) for row, score in zip(rows, scores)]
+
+    def train_if_stale(self) -> int:
+        """(Re)build the IVF lists when the matrix has outgrown them; returns the number of lists built."""
+        with self.lock:
+            if self.count < settings.ivf_min_vectors:
+                return 0
+            if self.trained_count and self.count - self.trained_count <= RETRAIN_GROWTH * self.trained_count:
+                return 0
+            return self.train()
+
+    def train(self) -> int:
+        """Fit spherical k-means centroids and group every row by its nearest centroid."""
+        with self.lock:
+            nlist = settings.ivf_lists or int(np.sqrt(self.count))
+            nlist = max(1, min(nlist, self.count))
+            rng = np.random.default_rng(0)
+            sample = self.vectors[np.sort(rng.choice(self.count, min(self.count, TRAIN_SAMPLE), replace=False))]
+            centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+            for _ in range(TRAIN_ITERATIONS):
+                labels = self._assign(sample, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = np.bincount(labels, minlength=nlist) == 0
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                centroids = (sums / norms).astype(np.float32)
+
+            labels = np.concatenate([
+                self._assign(self.vectors[start:start + SCAN_ROWS], centroids)
+                for start in range(0, self.count, SCAN_ROWS)
+            ])
+            order = np.argsort(labels, kind="stable")
+            offsets = np.searchsorted(labels[order], np.arange(nlist + 1))
+
+            with open(self._path("ivf.npz.tmp"), "wb") as f:
+                np.savez(f, centroids=centroids, order=order, offsets=offsets)
+            os.replace(self._path("ivf.npz.tmp"), self._path("ivf.npz"))
+            self.trained_count = self.count
+            self._write_meta()
+            self._load_ivf()
+            return nlist
+
+    def _assign(self, rows: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        return np.argmax(rows @ centroids.T, axis=1)
+
+    def _scan(self, query: np.ndarray, k: int, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for chunk_start in range(start, end, SCAN_ROWS):
+            chunk_end = min(chunk_start + SCAN_ROWS, end)
+            rows = np.concatenate([best_rows, np.arange(chunk_start, chunk_end)])
+            chunk_scores = self.vectors[chunk_start:chunk_end] @ query
+            if self.superseded is not None:
+                chunk_scores[self.superseded[chunk_start:chunk_end]] = -np.inf
+            scores = np.concatenate([best_scores, chunk_scores])
+            best_rows, best_scores = self._top(rows, scores, k)
+        live = np.isfinite(best_scores)
+        return best_rows[live], best_scores[live]
+
+    def _top(self, rows: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[keep], scores[keep]
+        ranked = np.argsort(-scores, kind="stable")
+        return rows[ranked], scores[ranked]
+
+    def _map(self) -> None:
+        if not self.count:
+            self.vectors = np.empty((0, self.dimension), dtype=np.float32)
+            self.ids = np.empty(0, dtype=np.int64)
+            return
+        self.vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r",
+                                 shape=(self.count, self.dimension))
+        self.ids = np.memmap(self._path("ids.i64"), dtype=np.int64, mode="r", shape=(self.count,))
+
+    def _load_superseded(self) -> None:
+        """Mark every row whose id appears again later in the matrix."""
+        self.max_id = int(self.ids.max()) if self.count else 0
+        self.superseded = None
+        if not self.count:
+            return
+        _, last_from_end = np.unique(self.ids[::-1], return_index=True)
+        if len(last_from_end) == self.count:
+            return
+        self.superseded = np.ones(self.count, dtype=bool)
+        self.superseded[self.count - 1 - last_from_end] = False
+
+    def _load_ivf(self) -> None:
+        self.centroids = self.order = self.offsets = None
+        if self.trained_count and os.path.exists(self._path("ivf.npz")):
+            with np.load(self._path("ivf.npz")) as ivf:
+                self.centroids = ivf["centroids"]
+                self.order = ivf["order"]
+                self.offsets = ivf["offsets"]
+
+    def _write_meta(self, meta: Optional[dict] = None) -> None:
+        meta = meta or {
+            "backend": self.backend,
+            "dimension": self.dimension,
+            "count": self.count,
+            "trained_count": self.trained_count
+        }
+        with open(self._path("meta.json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(self._path("meta.json.tmp"), self._path("meta.json"))
@@ -0,0 +1,98 @@
+import re
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
+from config import settings
+from services.llm_providers import LLMProvider
+from services.llm_analyzer import LLMAnalyzer
+from services.tokens import count_tokens
+
+class RecordingProvider(LLMProvider):
+    """Answers chunk summary prompts with an oversized summary naming the part, and records every prompt."""
+    PART = re.compile(r"Summarize part (\d+) of")
+
+    def __init__(self, summary_words: int):
+        super().__init__("test-model")
+        self.summary_words = summary_words
+        self.prompts: List[str] = []
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int,
+                       temperature: float = 0.3, model: Optional[str] = None) -> str:
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        match = self.PART.search(prompt)
+        if match:
+            return f"PART{match.group(1)} " + "detail " * self.summary_words
+        return "Thread summary"
+
+    async def stream(self, messages: List[Dict[str, str]], max_tokens: int,
+                     temperature: float = 0.3, model: Optional[str] = None) -> AsyncIterator[str]:
+        for word in (await self.complete(messages, max_tokens, temperature, model)).split(" "):
+            yield word + " "
+
+def make_thread(count: int) -> List[Dict]:
+    return [
+        {
+            "sender": f"person{i}@example.com",
+            "timestamp": f"2024-01-{i + 1:02d}",
+            "subject": "Plan",
+            "body": f"MESSAGE{i} " + "words " * 40
+        }
+        for i in range(count)
+    ]
+
+def test_thread_reduce_keeps_every_summary_when_no_progress(monkeypatch):
+    # Every chunk summary is larger than a whole chunk, so merging summaries cannot shrink them
+    monkeypatch.setattr(settings, "thread_chunk_tokens", 60)
+    provider = RecordingProvider(summary_words=200)
+    analyzer = LLMAnalyzer(provider)
+
+    result = asyncio.run(analyzer.analyze_thread(make_thread(4)))
+
+    chunks = result["chunks"]
+    assert chunks == 4
+    final_prompt = provider.prompts[-1]
+    assert "partial summaries" in final_prompt
+    for part in range(1, chunks + 1):
+        assert f"PART{part} " in final_prompt
+    # Only the map stage and the final analysis ran; no pointless reduce round
+    assert len(provider.prompts) == chunks + 1
+
+def test_thread_reduce_merges_summaries_that_fit(monkeypatch):
+    monkeypatch.setattr(settings, "thread_chunk_tokens", 60)
+    provider = RecordingProvider(summary_words=5)
+    analyzer = LLMAnalyzer(provider)
+
+    result = asyncio.run(analyzer.analyze_thread(make_thread(4)))
+
+    assert result["chunks"] == 4
+    final_prompt = provider.prompts[-1]
+    for part in range(1, 5):
+        assert f"PART{part} " in final_prompt
+
+def test_single_oversized_email_is_truncated_to_the_chunk_budget(monkeypatch):
+    monkeypatch.setattr(settings, "thread_chunk_tokens", 200)
+    provider = RecordingProvider(summary_words=5)
+    analyzer = LLMAnalyzer(provider)
+    thread = make_thread(1)
+    thread[0]["body"] = "word " * 50000
+
+    result = asyncio.run(analyzer.analyze_thread(thread))
+
+    assert "chunks" not in result
+    assert len(provider.prompts) == 1
+    assert count_tokens(provider.prompts[0]) < 400
+
+def test_streamed_thread_result_matches_analyze_thread(monkeypatch):
+    monkeypatch.setattr(settings, "thread_chunk_tokens", 60)
+    analyzer = LLMAnalyzer(RecordingProvider(summary_words=5))
+    thread = make_thread(4)
+
+    async def stream():
+        fields = {}
+        text = "".join([delta async for delta in analyzer.stream_thread_analysis(thread, fields)])
+        return {"analysis": text.strip(), **fields}
+
+    streamed = asyncio.run(stream())
+
+    assert streamed == asyncio.run(analyzer.analyze_thread(thread))
+    assert streamed["chunks"] == 4
@@ -0,0 +1,72 @@
+import base64
+import quopri
+from email import policy
+from email.parser import BytesParser
+import pytest
+from services.message_parser import MessageParser
+
+TEXT = "héllo wörld, ünïcode ✓ " * 50
+
+def make_part(encoding: str, body: bytes) -> bytes:
+    return (
+        b"From: a@example.com\r\n"
+        b"Content-Type: application/octet-stream\r\n"
+        b"Content-Disposition: attachment; filename=\"data.bin\"\r\n"
+        b"Content-Transfer-Encoding: " + encoding.encode() + b"\r\n\r\n" + body
+    )
+
+DATA = TEXT.encode("utf-8")
+BINARY = bytes(range(256)) * 12
+
+ENCODED = {
+    "base64-text": ("base64", DATA, base64.encodebytes(DATA)),
+    "base64-binary": ("base64", BINARY, base64.encodebytes(BINARY)),
+    "qp": ("quoted-printable", DATA, quopri.encodestring(DATA)),
+    "qp-crlf": ("quoted-printable", DATA, quopri.encodestring(DATA).replace(b"\n", b"\r\n")),
+    "8bit": ("8bit", DATA, DATA),
+    "binary": ("binary", BINARY, BINARY),
+}
+
+@pytest.mark.parametrize("encoding,data,body", ENCODED.values(), ids=ENCODED.keys())
+@pytest.mark.parametrize("chunk_size", [7, 64, 1024 * 1024])
+def test_decode_mime_part_round_trips(encoding, data, body, chunk_size):
+    part = BytesParser(policy=policy.compat32).parsebytes(make_part(encoding, body))
+    parser = MessageParser()
+    parser.chunk_size = chunk_size
+
+    decoded = b"".join(parser._decode_mime_part(part))
+
+    assert decoded == data
+    assert decoded == part.get_payload(decode=True)
+
+def make_message() -> bytes:
+    return (
+        b"From: a@example.com\r\n"
+        b"Message-ID: <known@example.com>\r\n"
+        b"Subject: report\r\n"
+        b"Content-Type: multipart/mixed; boundary=\"b\"\r\n\r\n"
+        b"--b\r\nContent-Type: text/plain\r\n\r\nsee attached\r\n"
+        b"--b\r\n" + make_part("base64", base64.encodebytes(DATA)).split(b"\r\n", 1)[1] +
+        b"\r\n--b--\r\n"
+    )
+
+def test_known_message_is_skipped_before_its_attachments_are_stored():
+    message = BytesParser(policy=policy.compat32).parsebytes(make_message())
+    parser = MessageParser(known=lambda fingerprint: True)
+    parser.store.put_stream = lambda chunks: pytest.fail("attachment stored for a known message")
+
+    record = parser.parse_mbox_message(message)
+
+    assert record['known']
+    assert 'attachments' not in record
+    assert record['fingerprint'] == MessageParser()._fingerprint(record)
+
+def test_new_message_keeps_its_attachments():
+    message = BytesParser(policy=policy.compat32).parsebytes(make_message())
+    parser = MessageParser(known=lambda fingerprint: False)
+    parser.store.put_stream = lambda chunks: {'path': 'p', 'sha256': 's', 'size': len(b"".join(chunks))}
+
+    record = parser.parse_mbox_message(message)
+
+    assert not record['known']
+    assert [(a['filename'], a['size']) for a in record['attachments']] == [("data.bin", len(DATA))]
@@ -36,21 +36,21 @@ export default function Dashboard() {
     const fetchData = async () => {
       try {
         // Fetch mailboxes
-        const mailboxesResponse = await fetch('http://localhost:8000/mailboxes')
+        const mailboxesResponse = await fetch('http://localhost:8000/mailboxes?limit=1000')
         if (!mailboxesResponse.ok) throw new Error('Failed to fetch mailboxes')
         const mailboxesData = await mailboxesResponse.json()
-        setMailboxes(mailboxesData)
+        setMailboxes(mailboxesData.items)
 
         // Calculate total emails from mailboxes
-        const totalEmails = mailboxesData.reduce((sum: number, mailbox: Mailbox) => sum + mailbox.total_messages, 0)
+        const totalEmails = mailboxesData.items.reduce((sum: number, mailbox: Mailbox) => sum + mailbox.total_messages, 0)
 
         // Fetch organizations
-        const orgsResponse = await fetch('http://localhost:8000/organizations')
+        const orgsResponse = await fetch('http://localhost:8000/organizations?limit=1&with_total=true')
         if (!orgsResponse.ok) throw new Error('Failed to fetch organizations')
         const orgsData = await orgsResponse.json()
 
         // Fetch contacts
-        const contactsResponse = await fetch('http://localhost:8000/contacts')
+        const contactsResponse = await fetch('http://localhost:8000/contacts?limit=1&with_total=true')
         if (!contactsResponse.ok) throw new Error('Failed to fetch contacts')
         const contactsData = await contactsResponse.json()
 
@@ -58,8 +58,8 @@ export default function Dashboard() {
           totalEmails,
           totalAttachments: 0, // Will be updated from attachment processing
           processedAttachments: 0,
-          organizations: orgsData.length,
-          contacts: contactsData.length
+          organizations: orgsData.total,
+          contacts: contactsData.total
         })
 
         // Start attachment processing